@@ -0,0 +1,200 @@
+# %%
+import os
+import hmac
+import time
+import base64
+import hashlib
+import getpass
+import logging
+from functools import lru_cache
+import bcrypt
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# Durée de validité (en secondes) d'un jeton de session après la connexion
+SESSION_TTL = 12 * 3600
+
+# Clé de la session Streamlit qui contient le jeton signé
+SESSION_TOKEN_KEY = "session_token"
+
+# Clé de signature des jetons si aucune n'est déclarée dans les secrets ([auth]
+# session_secret) : les jetons ne sont alors valables que dans ce processus
+_process_secret = os.urandom(32)
+
+
+# %%
+def hash_password(password):
+    """
+    Calcule le hachage bcrypt d'un mot de passe, à enregistrer dans les secrets.
+
+    Args:
+        password (str): Le mot de passe en clair.
+
+    Returns:
+        str: Le hachage bcrypt (ex. "$2b$12$...").
+    """
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+
+@lru_cache(maxsize=None)
+def _hash_once(password):
+    # Ancien format des secrets (mot de passe en clair) : un seul hachage (et un seul
+    # avertissement) par processus
+    logger.warning("Mot de passe en clair dans les secrets : déclarer st_password_hash")
+    return hash_password(password).encode()
+
+
+def load_user_db(secrets):
+    """
+    Construit la base des utilisateurs depuis les secrets, avec les hachages déjà calculés.
+
+    Chaque section "st_utilisateurs_*" déclare "st_username" et "st_password_hash" (voir
+    `python -m temtemOneAuth`). Une section qui ne déclare encore que "st_password" est
+    acceptée : son mot de passe n'est haché qu'une fois par processus.
+
+    Args:
+        secrets (Mapping): Les secrets de l'application (st.secrets).
+
+    Returns:
+        dict: Un dictionnaire {nom d'utilisateur: {"mot_de_passe": hachage bcrypt}}.
+    """
+    user_db = {}
+    for section, values in secrets.items():
+        if not section.startswith("st_utilisateurs_"):
+            continue
+        if "st_password_hash" in values:
+            hashed_password = values["st_password_hash"].encode()
+        else:
+            hashed_password = _hash_once(values["st_password"])
+        user_db[values["st_username"]] = {"mot_de_passe": hashed_password}
+    return user_db
+
+
+# %%
+def _signing_key():
+    try:
+        return st.secrets["auth"]["session_secret"].encode()
+    except (KeyError, FileNotFoundError):
+        return _process_secret
+
+
+def _signature(payload):
+    return hmac.new(_signing_key(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_token(username, ttl=SESSION_TTL):
+    """
+    Crée un jeton de session signé (HMAC-SHA256) pour un utilisateur authentifié.
+
+    Args:
+        username (str): Le nom d'utilisateur.
+        ttl (int): La durée de validité du jeton en secondes.
+
+    Returns:
+        str: Le jeton "utilisateur:expiration:signature" encodé en base64.
+    """
+    username = base64.urlsafe_b64encode(username.encode()).decode()
+    payload = f"{username}:{int(time.time()) + ttl}"
+    return f"{payload}:{_signature(payload)}"
+
+
+def verify_token(token):
+    """
+    Vérifie la signature et l'expiration d'un jeton de session.
+
+    Args:
+        token (str): Le jeton émis par `issue_token`.
+
+    Returns:
+        str | None: Le nom d'utilisateur, ou None si le jeton est invalide ou expiré.
+    """
+    try:
+        username, expires_at, signature = token.split(":")
+        expires_at = int(expires_at)
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature, _signature(f"{username}:{expires_at}")):
+        return None
+    if expires_at < time.time():
+        return None
+    return base64.urlsafe_b64decode(username.encode()).decode()
+
+
+def current_user():
+    """
+    Renvoie l'utilisateur connecté dans cette session, d'après son jeton signé.
+
+    Returns:
+        str | None: Le nom d'utilisateur, ou None si la session n'est pas connectée.
+    """
+    token = st.session_state.get(SESSION_TOKEN_KEY)
+    return verify_token(token) if token else None
+
+
+# %%
+def verify_credentials(user_db, username, password):
+    """
+    Vérifie les informations d'identification et ouvre la session si elles sont valides.
+
+    bcrypt n'est exécuté qu'ici, une fois par connexion : les reruns suivants de la
+    session sont authentifiés par le jeton signé gardé dans `st.session_state`.
+
+    Args:
+        user_db (dict): La base des utilisateurs (voir `load_user_db`).
+        username (str): Le nom d'utilisateur à vérifier.
+        password (str): Le mot de passe à vérifier.
+
+    Returns:
+        bool: True si les informations d'identification sont valides, False sinon.
+    """
+    if username not in user_db:
+        return False
+    if not bcrypt.checkpw(password.encode(), user_db[username]["mot_de_passe"]):
+        return False
+    st.session_state[SESSION_TOKEN_KEY] = issue_token(username)
+    return True
+
+
+def login(user_db):
+    """
+    Gère le processus de connexion en demandant à l'utilisateur de saisir un nom d'utilisateur et un mot de passe.
+
+    Une session déjà connectée (jeton valide) est acceptée sans formulaire ni bcrypt.
+
+    Args:
+        user_db (dict): La base des utilisateurs, avec les mots de passe hachés.
+
+    Returns:
+        bool: True si la session est connectée, False sinon.
+    """
+    if current_user() is not None:
+        return True
+
+    st.title("Connexion")
+    username = st.text_input("Nom d'utilisateur")
+    password = st.text_input("Mot de passe", type="password")
+
+    if st.button("Se connecter"):
+        if username not in user_db:
+            st.error("Nom d'utilisateur non trouvé.")
+        elif verify_credentials(user_db, username, password):
+            st.success("Connexion réussie !")
+            return True
+        else:
+            st.error("Nom d'utilisateur ou mot de passe incorrect.")
+
+    return False
+
+
+def logout():
+    """
+    Ferme la session courante (le jeton est retiré de `st.session_state`).
+    """
+    st.session_state.pop(SESSION_TOKEN_KEY, None)
+
+
+# %%
+if __name__ == "__main__":
+    # Calcul du hachage à déclarer dans .streamlit/secrets.toml (st_password_hash)
+    print(hash_password(getpass.getpass("Mot de passe : ")))
@@ -0,0 +1,407 @@
+# %%
+import numpy as np
+import pandas as pd
+from temtemOneFilters import FilterIndex
+
+try:
+    from pyroaring import BitMap
+except ImportError:  # pyroaring absent : ensembles en tableaux NumPy triés
+    BitMap = None
+
+
+def grouped_bitmaps(groups, codes, n_codes):
+    """
+    Construit l'ensemble des codes de chaque groupe.
+
+    Args:
+        groups (np.ndarray): Le groupe de chaque paire (entiers positifs).
+        codes (np.ndarray): Le code de chaque paire (entiers de 0 à n_codes - 1).
+        n_codes (int): Le nombre de codes.
+
+    Returns:
+        dict: Un dictionnaire {groupe: bitmap des codes (BitMap ou tableau trié)}.
+    """
+    n_codes = max(n_codes, 1)
+    # Une seule fois chaque paire, triées par groupe puis par code
+    pairs = np.unique(groups * n_codes + codes)
+    groups = pairs // n_codes
+    codes = (pairs % n_codes).astype(np.uint32)
+    keys, starts = np.unique(groups, return_index=True)
+    members = np.split(codes, starts[1:]) if len(keys) else []
+    if BitMap is not None:
+        members = [BitMap(codes) for codes in members]
+    return dict(zip(keys.tolist(), members))
+
+
+def union_bitmaps(bitmaps):
+    """
+    Calcule l'union de plusieurs bitmaps construits par `grouped_bitmaps`.
+
+    Args:
+        bitmaps (list): Les bitmaps (BitMap ou tableaux triés).
+
+    Returns:
+        BitMap | np.ndarray: L'union, du même type que les bitmaps.
+    """
+    if BitMap is not None:
+        return BitMap.union(*bitmaps) if bitmaps else BitMap()
+    if not bitmaps:
+        return np.empty(0, dtype=np.uint32)
+    if len(bitmaps) == 1:
+        return bitmaps[0]
+    return np.unique(np.concatenate(bitmaps))
+
+
+# %%
+# Taille maximale (clients x mois) de la grille de présence utilisée par
+# `compute_cohort_pivot` pour dédoublonner les (client, mois) ; au-delà, un hachage
+# est utilisé
+MAX_COHORT_GRID = 64 * 2**20
+
+
+def compute_cohort_pivot(filtered_data):
+    """
+    Calcule la matrice des cohortes : clients actifs par mois de première commande et par ancienneté.
+
+    Calcul de référence de `ActivityIndex.cohort_pivot`, qui doit donner la même
+    matrice sur les commandes finalisées filtrées. Les mois sont codés en entiers
+    (année * 12 + mois) et les clients en codes consécutifs : le mois de première
+    commande de chaque client, l'ancienneté de chaque commande et le nombre de clients
+    distincts par (cohorte, ancienneté) sont calculés avec NumPy, sans objets Period ni
+    appel Python par ligne.
+
+    Args:
+        filtered_data (pd.DataFrame): Les commandes filtrées (lues sans modification).
+
+    Returns:
+        pd.DataFrame: Le nombre de clients actifs, une ligne par cohorte (mois de la
+            première commande, index "cohort") et une colonne par nombre de mois depuis
+            cette commande (colonnes "period_number").
+    """
+    dates = filtered_data["date"].to_numpy(dtype="datetime64[ns]")
+    known = filtered_data["customer_id"].notna().to_numpy() & ~np.isnat(dates)
+    if not known.any():
+        return pd.DataFrame(
+            index=pd.PeriodIndex([], freq="M", name="cohort"),
+            columns=pd.Index([], dtype=np.int64, name="period_number"),
+            dtype=np.float64,
+        )
+    customers, _ = pd.factorize(filtered_data["customer_id"][known])
+    n_customers = customers.max() + 1
+
+    # Mois de chaque commande (année * 12 + mois - 1), lu dans une table par jour
+    days = dates[known].astype("datetime64[D]").astype(np.int64)
+    first_day = days.min()
+    calendar = np.arange(first_day, days.max() + 1).astype("datetime64[D]")
+    calendar = pd.DatetimeIndex(calendar)
+    month_of_day = (calendar.year * 12 + calendar.month - 1).to_numpy(np.int64)
+    first = month_of_day[0]
+    months = month_of_day[days - first_day] - first
+    span = months.max() + 1
+
+    # Mois de la première commande de chaque client, en une passe
+    first_month = np.full(n_customers, span, dtype=np.int64)
+    np.minimum.at(first_month, customers, months)
+
+    # Une seule fois chaque (client, mois d'activité)
+    activity = customers * span + months
+    if n_customers * span <= MAX_COHORT_GRID:
+        present = np.zeros(n_customers * span, dtype=bool)
+        present[activity] = True
+        active = np.flatnonzero(present)
+    else:
+        active = pd.unique(activity)
+    cohorts = first_month[active // span]
+    offsets = active % span - cohorts
+
+    # Nombre de clients distincts par (cohorte, ancienneté)
+    counts = np.bincount(cohorts * span + offsets, minlength=span * span)
+    counts = counts.reshape(span, span)
+    cohort_rows = np.flatnonzero(counts.any(axis=1))
+    offset_columns = np.flatnonzero(counts.any(axis=0))
+    counts = counts[np.ix_(cohort_rows, offset_columns)].astype(np.float64)
+    counts[counts == 0] = np.nan
+
+    periods = pd.period_range(
+        pd.Period(year=first // 12, month=first % 12 + 1, freq="M"),
+        periods=span,
+        freq="M",
+        name="cohort",
+    )
+    return pd.DataFrame(
+        counts,
+        index=periods[cohort_rows],
+        columns=pd.Index(offset_columns, dtype=np.int64, name="period_number"),
+    )
+
+
+# %%
+class ActivityIndex:
+    """
+    Index d'activité client x mois des commandes finalisées, pour les matrices de rétention.
+
+    Les clients sont codés en entiers. Pour chaque combinaison des colonnes indexées
+    (ex. customer_origine x businessCat), l'index garde les clients actifs de chaque
+    mois et de chaque jour sous forme de bitmaps compressés (pyroaring) ou, à défaut,
+    de tableaux NumPy triés. Une matrice de rétention ne lit plus les commandes :
+      - les clients actifs d'un mois sont l'union des bitmaps des combinaisons
+        retenues (bitmaps des jours pour les mois coupés par la plage de dates) ;
+      - la cohorte d'un mois est l'ensemble de ses clients actifs qui ne l'étaient
+        dans aucun mois précédent de la plage ;
+      - chaque case est la cardinalité de l'intersection d'une cohorte et des clients
+        actifs d'un mois.
+
+    Les plages de dates suivent `FilterIndex` : commandes à partir du jour de début à
+    minuit, jusqu'au jour de fin à minuit inclus. Chaque jour est donc coupé en deux
+    créneaux, les commandes passées à minuit pile et les autres, pour que ces bornes
+    restent exactes. Le résultat est celui de `compute_cohort_pivot` sur les commandes
+    finalisées filtrées par `FilterIndex.select` (voir `check_cohort_pivot`).
+
+    Args:
+        orders (pd.DataFrame): La table des commandes nettoyée (lue sans modification).
+        columns (list): Les colonnes filtrées par égalité (ex. "customer_origine").
+    """
+
+    def __init__(self, orders, columns=()):
+        self.columns = list(columns)
+        dates = orders["date"].to_numpy(dtype="datetime64[ns]")
+        completed = (
+            (orders["Status"] == "COMPLETED").to_numpy()
+            & orders["customer_id"].notna().to_numpy()
+            & ~np.isnat(dates)
+        )
+        orders = orders[completed]
+
+        customers, uniques = pd.factorize(orders["customer_id"])
+        self.n_customers = len(uniques)
+        dates = dates[completed]
+        days = dates.astype("datetime64[D]")
+        # Créneau de chaque commande : 2 * jour, + 1 si elle n'est pas passée à minuit
+        late = dates != days
+        days = days.astype(np.int64)
+        self.first_day = int(days.min()) if len(days) else 0
+        days -= self.first_day
+        n_days = int(days.max()) + 1 if len(days) else 0
+        slots = 2 * days + late
+
+        # Mois de chaque créneau (année * 12 + mois - 1, depuis le premier mois) et
+        # premier créneau de chaque mois
+        calendar = pd.DatetimeIndex(
+            np.arange(self.first_day, self.first_day + n_days).astype("datetime64[D]")
+        )
+        month_of_day = (calendar.year * 12 + calendar.month - 1).to_numpy(np.int64)
+        self.first_month = int(month_of_day[0]) if n_days else 0
+        self._month_of_slot = np.repeat(month_of_day - self.first_month, 2)
+        n_months = int(self._month_of_slot[-1]) + 1 if n_days else 0
+        self._month_starts = np.searchsorted(
+            self._month_of_slot, np.arange(n_months + 1)
+        )
+
+        # Combinaisons des colonnes indexées présentes dans les commandes
+        if self.columns:
+            grouped = orders.groupby(self.columns, observed=True, dropna=False)
+            combinations = grouped.ngroup().to_numpy(np.int64)
+            self.combinations = grouped.size().reset_index()[self.columns]
+        else:
+            combinations = np.zeros(len(orders), dtype=np.int64)
+            self.combinations = pd.DataFrame(index=range(1))
+
+        # Bitmaps par (combinaison, créneau) et par (combinaison, mois)
+        n_slots = 2 * n_days
+        self._slots = grouped_bitmaps(
+            combinations * n_slots + slots, customers, self.n_customers
+        )
+        self._months = grouped_bitmaps(
+            combinations * n_months + self._month_of_slot[slots],
+            customers,
+            self.n_customers,
+        )
+        self._n_slots = n_slots
+        self._n_months = n_months
+
+    def _slot(self, value):
+        # Premier créneau d'un jour : celui des commandes passées à minuit
+        day = np.datetime64(pd.Timestamp(value).normalize(), "D").astype(np.int64)
+        return 2 * int(day - self.first_day)
+
+    def active_customers(self, start_date=None, end_date=None, **equals):
+        """
+        Renvoie les clients actifs de chaque mois de la plage de dates.
+
+        Args:
+            start_date (date, optional): La date de début (incluse, à minuit).
+            end_date (date, optional): La date de fin (incluse, à minuit).
+            **equals: Les filtres d'égalité {colonne indexée: valeur}.
+
+        Returns:
+            tuple: Le numéro du premier mois (année * 12 + mois - 1) et la liste des
+                bitmaps des clients actifs de chaque mois, dans l'ordre.
+
+        Raises:
+            KeyError: Si une colonne filtrée n'est pas indexée.
+        """
+        first = 0 if start_date is None else max(self._slot(start_date), 0)
+        last = self._n_slots - 1
+        if end_date is not None:
+            # Le jour de fin ne compte que pour les commandes passées à minuit
+            last = min(self._slot(end_date), last)
+        if first > last:
+            return self.first_month, []
+
+        selected = np.ones(len(self.combinations), dtype=bool)
+        for column, value in equals.items():
+            selected &= (self.combinations[column] == value).to_numpy()
+        selected = np.flatnonzero(selected).tolist()
+
+        active = []
+        for month in range(self._month_of_slot[first], self._month_of_slot[last] + 1):
+            month_first = max(self._month_starts[month], first)
+            month_last = min(self._month_starts[month + 1] - 1, last)
+            whole_month = (
+                month_first == self._month_starts[month]
+                and month_last == self._month_starts[month + 1] - 1
+            )
+            if whole_month:
+                # Mois entier : bitmaps des mois
+                parts = [
+                    self._months.get(combination * self._n_months + month)
+                    for combination in selected
+                ]
+            else:
+                # Mois coupé par la plage de dates : bitmaps des créneaux retenus
+                parts = [
+                    self._slots.get(combination * self._n_slots + slot)
+                    for combination in selected
+                    for slot in range(month_first, month_last + 1)
+                ]
+            active.append(union_bitmaps([part for part in parts if part is not None]))
+        return self.first_month + self._month_of_slot[first], active
+
+    def cohort_pivot(self, start_date=None, end_date=None, **equals):
+        """
+        Calcule la matrice des cohortes des commandes finalisées qui vérifient les filtres.
+
+        Args:
+            start_date (date, optional): La date de début (incluse, à minuit).
+            end_date (date, optional): La date de fin (incluse, à minuit).
+            **equals: Les filtres d'égalité {colonne indexée: valeur}.
+
+        Returns:
+            pd.DataFrame: Le nombre de clients actifs, une ligne par cohorte (mois de la
+                première commande, index "cohort") et une colonne par nombre de mois
+                depuis cette commande (colonnes "period_number"), comme
+                `compute_cohort_pivot`.
+        """
+        first_month, active = self.active_customers(start_date, end_date, **equals)
+        n_months = len(active)
+        counts = np.zeros((n_months, n_months), dtype=np.int64)
+        if BitMap is not None:
+            seen = BitMap()
+            cohorts = []
+            for customers in active:
+                cohorts.append(customers - seen)
+                seen |= customers
+            for cohort, members in enumerate(cohorts):
+                if not members:
+                    continue
+                for month in range(cohort, n_months):
+                    counts[cohort, month - cohort] = members.intersection_cardinality(
+                        active[month]
+                    )
+        else:
+            # Cohorte de chaque client (-1 : pas encore actif) ; les cases d'un mois
+            # sont comptées pour toutes les cohortes à la fois
+            cohort_of = np.full(self.n_customers, -1, dtype=np.int64)
+            for month, customers in enumerate(active):
+                cohort_of[customers[cohort_of[customers] < 0]] = month
+                sizes = np.bincount(cohort_of[customers], minlength=month + 1)
+                cohorts = np.flatnonzero(sizes)
+                counts[cohorts, month - cohorts] = sizes[cohorts]
+
+        cohort_rows = np.flatnonzero(counts.any(axis=1))
+        offset_columns = np.flatnonzero(counts.any(axis=0))
+        counts = counts[np.ix_(cohort_rows, offset_columns)].astype(np.float64)
+        counts[counts == 0] = np.nan
+
+        periods = pd.period_range(
+            pd.Period(year=first_month // 12, month=first_month % 12 + 1, freq="M"),
+            periods=max(n_months, 1),
+            freq="M",
+            name="cohort",
+        )
+        return pd.DataFrame(
+            counts,
+            index=periods[cohort_rows],
+            columns=pd.Index(offset_columns, dtype=np.int64, name="period_number"),
+        )
+
+
+# %%
+def check_cohort_pivot(orders, columns, queries):
+    """
+    Vérifie que `ActivityIndex.cohort_pivot` donne la matrice de `compute_cohort_pivot`.
+
+    La matrice de référence est calculée sur les commandes filtrées par
+    `FilterIndex.select` puis limitées aux commandes finalisées, comme dans la page
+    Retention avant l'index d'activité.
+
+    Args:
+        orders (pd.DataFrame): La table des commandes nettoyée.
+        columns (list): Les colonnes filtrées par égalité.
+        queries (list): Les requêtes à vérifier : (date de début, date de fin,
+            {colonne: valeur}).
+
+    Raises:
+        AssertionError: Si une matrice diffère de la référence.
+    """
+    activity = ActivityIndex(orders, columns)
+    index = FilterIndex(orders, columns)
+    for start_date, end_date, equals in queries:
+        filtered = index.select(start_date, end_date, **equals)
+        expected = compute_cohort_pivot(filtered[filtered["Status"] == "COMPLETED"])
+        pd.testing.assert_frame_equal(
+            activity.cohort_pivot(start_date, end_date, **equals),
+            expected,
+            obj=f"cohort_pivot{(start_date, end_date, equals)}",
+        )
+
+
+if __name__ == "__main__":
+    # Vérification sur des commandes générées : python temtemOneBitmaps.py
+    rng = np.random.default_rng(0)
+    n = 50_000
+    seconds = rng.integers(0, 800 * 86400, n)
+    # Une commande sur cinq passée à minuit pile, pour vérifier les bornes de dates
+    midnight = rng.random(n) < 0.2
+    seconds[midnight] -= seconds[midnight] % 86400
+    customer_ids = pd.array(rng.integers(0, 5_000, n), dtype="Int64")
+    customer_ids[rng.random(n) < 0.01] = pd.NA
+    orders = pd.DataFrame(
+        {
+            "date": pd.Timestamp("2023-01-01") + pd.to_timedelta(seconds, "s"),
+            "customer_origine": pd.Categorical(rng.choice(["Local", "Diaspora"], n)),
+            "businessCat": pd.Categorical(
+                rng.choice(["Airtime", "Alimentation", "Shopping"], n)
+            ),
+            "Status": pd.Categorical(rng.choice(["COMPLETED", "CANCELED"], n)),
+            "customer_id": customer_ids,
+        }
+    )
+    queries = [
+        (None, None, {}),
+        ("2030-01-01", None, {}),
+        ("2023-05-05", "2023-05-05", {}),
+    ]
+    for _ in range(50):
+        start = pd.Timestamp("2022-12-01") + pd.Timedelta(
+            days=int(rng.integers(0, 850))
+        )
+        end = start + pd.Timedelta(days=int(rng.integers(0, 400)))
+        equals = {}
+        if rng.random() < 0.5:
+            equals["customer_origine"] = rng.choice(["Local", "Diaspora", "Autre"])
+        if rng.random() < 0.5:
+            equals["businessCat"] = rng.choice(["Airtime", "Shopping"])
+        queries.append((start.date(), end.date(), equals))
+    check_cohort_pivot(orders, ["customer_origine", "businessCat"], queries)
+    print(f"{len(queries)} matrices identiques à compute_cohort_pivot")
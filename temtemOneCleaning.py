@@ -0,0 +1,231 @@
+# %%
+import os
+import numpy as np
+import pandas as pd
+import toml
+from temtemOneSchema import parse_ids, replace_categories
+from temtemOneTiming import timed
+
+# Registre des exclusions (commandes et clients de test), commun aux deux applications
+EXCLUSIONS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "exclusions.toml"
+)
+
+
+def load_exclusions(path=EXCLUSIONS_FILE):
+    """
+    Charge le registre des exclusions et normalise les identifiants au type des colonnes.
+
+    Args:
+        path (str): Le chemin du fichier TOML du registre.
+
+    Returns:
+        dict: Un dictionnaire avec "version", "order_ids" (chaînes) et "customer_ids"
+            (entiers Int64, comme la colonne customer_id).
+    """
+    registry = toml.load(path)
+    return {
+        "version": registry["version"],
+        "order_ids": pd.Index(
+            [str(order_id) for order_id in registry.get("order_ids", [])],
+            dtype="string[pyarrow]",
+        ),
+        "customer_ids": pd.Index(
+            parse_ids(
+                pd.Series(
+                    [
+                        str(customer_id)
+                        for customer_id in registry.get("customer_ids", [])
+                    ],
+                    dtype=object,
+                )
+            ).dropna()
+        ),
+    }
+
+
+# Registre chargé une seule fois par processus
+EXCLUSIONS = load_exclusions()
+
+
+def excluded_mask(df, exclusions=None):
+    """
+    Calcule le masque des commandes et des clients de test d'un DataFrame.
+
+    Les colonnes présentes parmi "order_id" et "customer_id" sont comparées (par
+    hachage) aux identifiants du registre et les masques sont combinés.
+
+    Args:
+        df (pd.DataFrame): Le DataFrame à filtrer.
+        exclusions (dict, optional): Le registre (voir `load_exclusions`), `EXCLUSIONS`
+            par défaut.
+
+    Returns:
+        np.ndarray: Un tableau booléen, True pour les lignes à exclure.
+    """
+    exclusions = EXCLUSIONS if exclusions is None else exclusions
+    excluded = np.zeros(len(df), dtype=bool)
+    if "order_id" in df.columns:
+        excluded |= df["order_id"].isin(exclusions["order_ids"]).to_numpy()
+    if "customer_id" in df.columns:
+        excluded |= df["customer_id"].isin(exclusions["customer_ids"]).to_numpy()
+    return excluded
+
+
+def drop_excluded(df, exclusions=None):
+    """
+    Retire les commandes et les clients de test en une seule passe.
+
+    Args:
+        df (pd.DataFrame): Le DataFrame à filtrer.
+        exclusions (dict, optional): Le registre (voir `load_exclusions`), `EXCLUSIONS`
+            par défaut.
+
+    Returns:
+        pd.DataFrame: Le DataFrame sans les lignes exclues.
+    """
+    return df[~excluded_mask(df, exclusions)]
+
+
+# Colonnes conservées dans la table des commandes nettoyée
+ORDERS_COLUMNS = [
+    "date",
+    "Status",
+    "customer_origine",
+    "paymentType",
+    "order_id",
+    "Order_Type",
+    "businessCat",
+    "customer_id",
+    "Occurence",
+    "previous_order_date",
+    "returning_customer",
+    "customer_username",
+    "customer_phone",
+    "customer_email",
+    "total_amount_dzd",
+]
+
+# Noms des colonnes brutes (orders.csv) renommées dans la table nettoyée
+ORDERS_RENAMED = {"job_status": "Status", "Order Type": "Order_Type"}
+
+# Colonnes lues dans orders.csv : celles de `ORDERS_COLUMNS`, sous leur nom brut
+ORDERS_RAW_COLUMNS = [
+    {new: old for old, new in ORDERS_RENAMED.items()}.get(column, column)
+    for column in ORDERS_COLUMNS
+]
+
+# Colonnes lues dans ltv_data.csv
+LTV_COLUMNS = [
+    "date",
+    "job_status",
+    "customer_origine",
+    "order_id",
+    "businessCat",
+    "customer_id",
+    "total_amount_dzd",
+    "EUR",
+    "marge_dzd",
+    "marge_eur",
+]
+
+# Catégories de la table LTV conservées
+LTV_BUSINESS_CATS = ["Airtime", "Alimentation", "Shopping"]
+
+# Colonnes lues dans users_2023.csv
+USERS_COLUMNS = [
+    "date",
+    "customer_id",
+    "lastName",
+    "firstName",
+    "phone",
+    "email",
+    "tags",
+    "Origine",
+    "customer_country",
+]
+
+
+# %%
+# Fonction pour nettoyer la table des commandes
+def clean_orders(orders):
+    """
+    Nettoie la table des commandes brute chargée depuis S3.
+
+    Le nettoyage est appliqué ligne par ligne (aucune agrégation) : il peut donc être
+    appliqué séparément à chaque partition mensuelle puis les résultats concaténés.
+
+    Args:
+        orders (pd.DataFrame): La table des commandes brute (orders.csv ou une partition).
+
+    Returns:
+        pd.DataFrame: La table des commandes nettoyée, limitée aux colonnes de `ORDERS_COLUMNS`.
+    """
+    # Tous les prédicats de lignes sont combinés en un seul masque : la table n'est
+    # copiée qu'une fois, déjà limitée aux lignes et aux colonnes conservées
+    with timed("filter:orders", orders) as stage:
+        keep = (
+            ~orders["job_status"].isin(["ABANDONED"]).to_numpy()
+            & orders["businessCat"].notna().to_numpy()
+            & ~excluded_mask(orders)
+        )
+        orders = stage.output(orders.loc[keep, ORDERS_RAW_COLUMNS])
+    orders.columns = ORDERS_COLUMNS
+
+    # Transformations de colonnes, sur les lignes conservées seulement
+    orders["businessCat"] = replace_categories(
+        orders["businessCat"],
+        {"Recharge mobile": "Airtime", "Recharge mobile / ADSL": "Airtime"},
+    )
+    if "EXTERNE" not in orders["Order_Type"].cat.categories:
+        orders["Order_Type"] = orders["Order_Type"].cat.add_categories("EXTERNE")
+    orders.loc[(orders["customer_id"] == 73187559488), "Order_Type"] = "EXTERNE"
+
+    return orders
+
+
+# Fonction pour nettoyer la table LTV
+def clean_ltv_data(ltv_data):
+    """
+    Nettoie la table LTV brute chargée depuis S3 et ne garde que les commandes finalisées.
+
+    Args:
+        ltv_data (pd.DataFrame): La table ltv_data brute.
+
+    Returns:
+        pd.DataFrame: La table LTV nettoyée.
+    """
+    # Un seul masque pour tous les prédicats (les commandes COMPLETED excluent déjà
+    # les commandes ABANDONED) : la table n'est copiée qu'une fois
+    with timed("filter:ltv_data", ltv_data) as stage:
+        keep = (
+            ltv_data["businessCat"].isin(LTV_BUSINESS_CATS).to_numpy()
+            & (ltv_data["job_status"] == "COMPLETED").to_numpy()
+            & ~excluded_mask(ltv_data)
+        )
+        ltv_data = stage.output(ltv_data[keep])
+
+    ltv_data["total_amount_eur"] = ltv_data["total_amount_dzd"] * ltv_data["EUR"]
+    return ltv_data
+
+
+# Fonction pour nettoyer la table des utilisateurs
+def clean_users(users):
+    """
+    Nettoie la table des utilisateurs brute (users_2023) chargée depuis S3.
+
+    Args:
+        users (pd.DataFrame): La table des utilisateurs brute.
+
+    Returns:
+        pd.DataFrame: La table des utilisateurs nettoyée.
+    """
+    with timed("filter:users", users) as stage:
+        users = stage.output(drop_excluded(users))
+
+    # Transformations de colonnes, sur les lignes conservées seulement
+    users["tags"] = users["tags"].str.replace(r"\[|\]", "", regex=True)
+    users["tags"] = users["tags"].str.replace(r"['\"]", "", regex=True)
+
+    users["date"] = users["date"].dt.normalize()
+    return users.rename(columns={"Origine": "customer_origine"})
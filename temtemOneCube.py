@@ -0,0 +1,181 @@
+# %%
+import numpy as np
+import pandas as pd
+from temtemOneBitmaps import grouped_bitmaps, union_bitmaps
+
+# Dimensions du cube, en plus du jour de la commande
+CUBE_DIMENSIONS = ["customer_origine", "businessCat", "Status"]
+
+# Dimensions qui filtrent les premières commandes des clients (nouveaux clients)
+FIRST_ORDER_DIMENSIONS = ["customer_origine", "businessCat"]
+
+
+# %%
+class OrdersCube:
+    """
+    Cube journalier pré-agrégé des commandes : jour x customer_origine x businessCat x Status.
+
+    Le cube est construit une fois par version des commandes (dans le magasin). Chaque
+    cellule garde le nombre de commandes, la somme de "total_amount_dzd" et le bitmap
+    des clients (codés en entiers) qui y ont commandé ; le nombre exact de clients
+    distincts de plusieurs cellules est la cardinalité de l'union de leurs bitmaps. Les
+    dates de première commande (finalisée) des clients sont aussi gardées, triées, pour
+    chaque combinaison de filtres sur customer_origine et businessCat : compter les
+    nouveaux clients n'est qu'une recherche dichotomique.
+
+    Les indicateurs sont donc calculés sur quelques milliers de cellules au lieu des
+    commandes. Les plages de dates suivent `FilterIndex` : commandes à partir du jour
+    de début à minuit, jusqu'au jour de fin à minuit inclus. Les commandes passées à
+    minuit pile ont leurs propres cellules, pour que ces bornes restent exactes.
+
+    Args:
+        orders (pd.DataFrame): La table des commandes nettoyée (lue sans modification).
+    """
+
+    def __init__(self, orders):
+        days = orders["date"].dt.normalize()
+        midnight = (orders["date"] == days).rename("midnight")
+        keys = [days.rename("date"), midnight] + [
+            orders[column] for column in CUBE_DIMENSIONS
+        ]
+        grouped = orders.groupby(keys, observed=True, dropna=False, sort=True)
+        cell = grouped.ngroup().to_numpy()
+
+        self.cells = grouped.agg(
+            orders=("order_id", "count"),
+            total_amount_dzd=("total_amount_dzd", "sum"),
+        ).reset_index()
+        self._days = self.cells["date"].to_numpy(dtype="datetime64[ns]")
+        self._midnight = self.cells["midnight"].to_numpy(dtype=bool)
+
+        known = orders["customer_id"].notna().to_numpy()
+        customers, uniques = pd.factorize(orders["customer_id"])
+        self._customers = grouped_bitmaps(
+            cell[known].astype(np.int64), customers[known], len(uniques)
+        )
+
+        # Première commande finalisée de chaque client, par customer_origine et par
+        # Business Catégorie
+        completed = (orders["Status"] == "COMPLETED").to_numpy() & known
+        first_orders = (
+            orders.loc[completed, ["customer_id", *FIRST_ORDER_DIMENSIONS, "date"]]
+            .groupby(
+                ["customer_id", *FIRST_ORDER_DIMENSIONS], observed=True, dropna=False
+            )["date"]
+            .min()
+            .reset_index()
+        )
+
+        # Dates triées des premières commandes, pour chaque ensemble de dimensions
+        # filtrées : {dimensions: {valeurs: dates}}
+        self._first_orders = {
+            dimensions: self._first_order_dates(first_orders, dimensions)
+            for dimensions in [
+                (),
+                ("customer_origine",),
+                ("businessCat",),
+                ("customer_origine", "businessCat"),
+            ]
+        }
+
+    @staticmethod
+    def _first_order_dates(first_orders, dimensions):
+        # Première commande de chaque client parmi les valeurs de `dimensions`, puis
+        # dates triées par combinaison de ces valeurs
+        first = (
+            first_orders.groupby(
+                ["customer_id", *dimensions], observed=True, dropna=False
+            )["date"]
+            .min()
+            .reset_index()
+        )
+        if not dimensions:
+            return {(): np.sort(first["date"].to_numpy(dtype="datetime64[ns]"))}
+        return {
+            key if isinstance(key, tuple) else (key,): np.sort(
+                dates.to_numpy(dtype="datetime64[ns]")
+            )
+            for key, dates in first.groupby(
+                list(dimensions), observed=True, dropna=False
+            )["date"]
+        }
+
+    def _cell_mask(self, start_date, end_date, **equals):
+        mask = np.ones(len(self.cells), dtype=bool)
+        if start_date is not None:
+            mask &= self._days >= np.datetime64(pd.Timestamp(start_date), "ns")
+        if end_date is not None:
+            end = np.datetime64(pd.Timestamp(end_date), "ns")
+            # Le jour de fin ne compte que pour les commandes passées à minuit
+            mask &= np.where(self._midnight, self._days <= end, self._days < end)
+        for column, value in equals.items():
+            mask &= (self.cells[column] == value).to_numpy()
+        return mask
+
+    def totals(self, start_date=None, end_date=None, **equals):
+        """
+        Renvoie le nombre de commandes et le montant total des cellules filtrées.
+
+        Args:
+            start_date (date, optional): La date de début (incluse).
+            end_date (date, optional): La date de fin (incluse).
+            **equals: Les filtres d'égalité {dimension: valeur}.
+
+        Returns:
+            dict: {"orders": nombre de commandes, "total_amount_dzd": montant total}.
+        """
+        cells = self.cells[self._cell_mask(start_date, end_date, **equals)]
+        return {
+            "orders": int(cells["orders"].sum()),
+            "total_amount_dzd": float(cells["total_amount_dzd"].sum()),
+        }
+
+    def distinct_customers(self, start_date=None, end_date=None, **equals):
+        """
+        Compte les clients distincts des cellules filtrées.
+
+        Args:
+            start_date (date, optional): La date de début (incluse).
+            end_date (date, optional): La date de fin (incluse).
+            **equals: Les filtres d'égalité {dimension: valeur}.
+
+        Returns:
+            int: Le nombre de clients distincts.
+        """
+        cells = np.flatnonzero(self._cell_mask(start_date, end_date, **equals))
+        bitmaps = [self._customers[cell] for cell in cells if cell in self._customers]
+        return len(union_bitmaps(bitmaps))
+
+    def new_customers(self, start_date=None, end_date=None, **equals):
+        """
+        Compte les clients dont la première commande finalisée tombe dans la plage de dates.
+
+        Seules les commandes qui vérifient les filtres comptent : avec un filtre sur
+        "businessCat", il s'agit de la première commande dans cette Business Catégorie.
+        Le filtre sur "Status" est ignoré.
+
+        Args:
+            start_date (date, optional): La date de début (incluse).
+            end_date (date, optional): La date de fin (incluse).
+            **equals: Les filtres d'égalité {dimension: valeur}.
+
+        Returns:
+            int: Le nombre de nouveaux clients.
+        """
+        dimensions = tuple(
+            column for column in FIRST_ORDER_DIMENSIONS if column in equals
+        )
+        dates = self._first_orders[dimensions].get(
+            tuple(equals[column] for column in dimensions)
+        )
+        if dates is None:
+            return 0
+        lo = 0
+        hi = len(dates)
+        if start_date is not None:
+            lo = np.searchsorted(dates, np.datetime64(pd.Timestamp(start_date), "ns"))
+        if end_date is not None:
+            hi = np.searchsorted(
+                dates, np.datetime64(pd.Timestamp(end_date), "ns"), "right"
+            )
+        return int(max(hi - lo, 0))
@@ -1,416 +1,196 @@
 # %%
-from operator import attrgetter
 from datetime import datetime, timedelta
-import os
-from io import StringIO
 from io import BytesIO
-import re
-import json
+import time
 import pandas as pd
 import numpy as np
-import boto3
-import bcrypt
 import xlsxwriter
-from st_files_connection import FilesConnection
 import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
-import toml
+from temtemOneData import load_file, load_partitioned_dataset
+from temtemOneStorage import get_backend
+from temtemOneCleaning import (
+    ORDERS_RAW_COLUMNS,
+    LTV_COLUMNS,
+    clean_orders,
+    clean_ltv_data,
+)
+from temtemOneStore import DatasetStore, SharedFrames
+from temtemOneEtl import gold_file_name
+import temtemOneAuth as auth
+from temtemOneAuth import load_user_db
+from temtemOneFilters import FilterIndex, equality_filters
+from temtemOneCube import OrdersCube
+from temtemOneBitmaps import ActivityIndex
+from temtemOneTiming import timed, timed_step, stage_report, log_run
 
 # import gspread
 # from oauth2client.service_account import ServiceAccountCredentials
 
 
 # %%
-# Fonction pour charger les secrets depuis le fichier secrets.toml
-def load_secrets():
-    """
-    Charge les secrets depuis le fichier 'secrets.toml'.
-
-    Returns:
-        dict: Un dictionnaire contenant les secrets chargés.
-    """
-    # Obtenez le chemin complet vers le fichier secrets.toml
-    secrets_file_path = os.path.join(".streamlit", "secrets.toml")
-
-    # Chargez le fichier secrets.toml
-    secrets = toml.load(secrets_file_path)
-
-    return secrets
-
-
-# Fonction pour charger les données depuis S3 en utilisant les secrets du fichier toml
-@st.cache_data
-def load_data_from_s3_with_toml(secrets, bucket_name, file_name):
-    """
-    Charge les données depuis un fichier stocké sur Amazon S3 en utilisant les informations de connexion fournies.
-
-    Args:
-        secrets (dict): Un dictionnaire contenant les informations d'identification AWS.
-        bucket_name (str): Le nom du bucket S3.
-        file_name (str): Le nom du fichier à charger depuis S3.
-
-    Returns:
-        pd.DataFrame: Un DataFrame Pandas contenant les données du fichier chargé depuis S3.
-    """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=secrets["s3_credentials"]["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=secrets["s3_credentials"]["AWS_SECRET_ACCESS_KEY"],
-    )
-    response = s3_client.get_object(Bucket=bucket_name, Key=file_name)
-    object_content = response["Body"].read().decode("utf-8")
-    return pd.read_csv(StringIO(object_content), delimiter=",", low_memory=False)
-
+# Mode de fonctionnement (Codespaces ou production en ligne)
+# "production" : connexion Streamlit, "local" : copie locale du bucket (profilage, tests
+# de charge, sans accès réseau), sinon boto3 avec les secrets de .streamlit/secrets.toml
+mode = "production"  # Vous pouvez définir ceci en fonction de votre environnement
 
-# Fonction pour charger les données depuis S3 en utilisant experimental_connection
-def load_data_from_s3_with_connection(bucket_name, file_name):
-    """
-    Charge les données depuis un fichier stocké sur Amazon S3 en utilisant la connexion expérimentale Streamlit.
+# Nom du seau S3
+bucket_name = "one-data-lake"
 
-    Args:
-        bucket_name (str): Le nom du bucket S3.
-        file_name (str): Le nom du fichier à charger depuis S3.
+# Copie locale du seau (même arborescence), utilisée en mode "local"
+local_data_dir = "one-data-lake"
+
+# Organisation des commandes sur S3 : "monolithic" (csv_database/orders.csv) ou
+# "partitioned" (un fichier par mois : csv_database/orders/2024-05.csv, ...)
+orders_layout = "monolithic"
+orders_prefix = "csv_database/orders/"
+
+# Source des datasets nettoyés : "raw" (CSV nettoyés dans l'application) ou "gold"
+# (Parquet déjà nettoyés publiés par l'ETL : python -m temtemOneEtl)
+data_source = "raw"
+gold_prefix = "gold/"
+
+# Intervalle (en secondes) entre deux rafraîchissements des données en arrière-plan
+refresh_interval = 600
+
+# Répertoire partagé par les processus Streamlit de la machine (ex. "/dev/shm/temtem") :
+# les DataFrames nettoyés y sont publiés en Arrow IPC et mappés en mémoire par tous
+# les processus. None : chaque processus garde ses propres DataFrames
+shared_memory_dir = None
+
+# Panneau d'administration dans la barre latérale : temps, lignes et mémoire de chaque
+# étape du chargement (les temps sont aussi écrits dans le journal à chaque exécution)
+show_timing_panel = False
+
+# Début de l'exécution du script, pour la ligne de journal des temps de démarrage
+run_started = time.perf_counter()
+
+# Fichiers à télécharger depuis S3, par dataset
+file_names = {
+    "orders": "csv_database/orders.csv",
+    "ltv_data": "csv_database/ltv_data.csv",
+    # "users_2023": "csv_database/users_2023.csv",
+    "customer_geolocalisation": "csv_database/customer_geolocalisation.csv",
+    "key_google": "key_google_json/key_google.json",
+}
 
-    Returns:
-        pd.DataFrame: Un DataFrame Pandas contenant les données du fichier chargé depuis S3.
-    """
-    conn = st.experimental_connection("s3", type=FilesConnection)
-    return conn.read(
-        f"{bucket_name}/{file_name}",
-        input_format="csv",
-        ttl=600,
-        low_memory=False,
-    )
+# Colonnes utilisées par l'application, par dataset : seules ces colonnes sont lues depuis S3
+columns = {
+    "orders": ORDERS_RAW_COLUMNS,
+    "ltv_data": LTV_COLUMNS,
+    "customer_geolocalisation": ["wilaya", "commune", "Latitude", "Longitude"],
+}
 
 
-# Fonction pour charger key_google.json depuis S3 en tant qu'objet JSON
-def load_key_google_json_with_json_key(secrets, bucket_name, file_name):
+def dataset_loaders():
     """
-    Charge une clé JSON Google depuis un fichier stocké sur Amazon S3 en utilisant les informations de connexion S3.
+    Déclare comment charger et nettoyer chaque dataset de l'application.
 
-    Args:
-        secrets (dict): Un dictionnaire contenant les informations de connexion S3.
-        bucket_name (str): Le nom du bucket S3.
-        file_name (str): Le nom du fichier à charger depuis S3.
+    Les datasets sont chargés à la demande par le magasin : la page "Retention" n'a
+    besoin que des commandes, "Lifetime Value (LTV)" de ltv_data et la page des
+    communes de customer_geolocalisation.
 
     Returns:
-        dict: Un objet JSON représentant la clé Google chargée depuis le fichier.
+        dict: Un dictionnaire {nom du dataset: fonction de chargement}.
     """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=secrets["s3_credentials"]["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=secrets["s3_credentials"]["AWS_SECRET_ACCESS_KEY"],
-    )
-    response = s3_client.get_object(Bucket=bucket_name, Key=file_name)
-    object_content = response["Body"].read().decode("utf-8")
-
-    # Utilisez la bibliothèque json pour charger le contenu en tant qu'objet JSON
-    return json.loads(object_content)
+    # Backend de stockage choisi par le mode (S3 ou copie locale)
+    backend = get_backend(mode, bucket_name, local_data_dir)
+
+    def load(name):
+        return load_file(backend, file_names[name], columns.get(name))
+
+    def load_cleaned(name, clean, source=None):
+        if data_source == "gold":
+            # Dataset déjà nettoyé et typé par l'ETL : rien à nettoyer ici
+            return load_file(backend, gold_file_name(name, gold_prefix))
+        return timed_step(f"clean:{name}", clean)(load(source or name))
+
+    # Nettoyage mesuré (temps, lignes et mémoire) pour le rapport de démarrage
+    clean_orders_timed = timed_step("clean:orders", clean_orders)
+
+    def load_orders(store):
+        if data_source == "gold":
+            return load_cleaned("orders", clean_orders)
+        if orders_layout == "partitioned":
+            # Seules les partitions nouvelles ou modifiées sont téléchargées et nettoyées
+            return load_partitioned_dataset(
+                backend, orders_prefix, clean_orders_timed, columns["orders"]
+            )
+        return clean_orders_timed(load("orders"))
+
+    def load_order_payment_screen(store):
+        orders = store["orders"]
+        return orders[
+            ["date", "businessCat", "order_id", "Status", "customer_email"]
+        ].rename(columns={"customer_email": "email"})
+
+    def load_orders_pmi(store):
+        orders = store["orders"]
+        return orders[orders["Order_Type"] == "EXTERNE"]
+
+    return {
+        "orders": load_orders,
+        "order_payment_screen": load_order_payment_screen,
+        "orders_pmi": load_orders_pmi,
+        "ltv_data": lambda store: load_cleaned("ltv_data", clean_ltv_data),
+        "customer_geolocalisation": lambda store: load("customer_geolocalisation"),
+        # Index de filtrage (dates triées, positions par valeur des listes déroulantes)
+        "orders_index": lambda store: FilterIndex(
+            store["orders"], ["customer_origine", "businessCat"]
+        ),
+        "ltv_data_index": lambda store: FilterIndex(
+            store["ltv_data"], ["customer_origine", "businessCat"]
+        ),
+        # Cube journalier pré-agrégé des commandes, pour les indicateurs
+        "orders_cube": lambda store: OrdersCube(store["orders"]),
+        # Clients actifs par mois (bitmaps), pour les matrices de rétention
+        "orders_activity": lambda store: ActivityIndex(
+            store["orders"], ["customer_origine", "businessCat"]
+        ),
+        # key_google.json est chargé en tant qu'objet JSON
+        "key_google": lambda store: load("key_google"),
+    }
 
 
-def load_key_google_json_with_connection(bucket_name, file_name):
+# Magasin partagé par toutes les sessions : chaque dataset n'est chargé et nettoyé
+# qu'une fois par processus, et non à chaque rerun du script
+@st.cache_resource
+def get_dataset_store(mode, bucket_name, orders_layout, data_source):
     """
-    Charge une clé JSON Google depuis un fichier stocké sur Amazon S3 en utilisant la connexion expérimentale Streamlit.
+    Crée le magasin de datasets du processus (un par configuration de chargement).
 
     Args:
+        mode (str): Le mode de fonctionnement.
         bucket_name (str): Le nom du bucket S3.
-        file_name (str): Le nom du fichier à charger depuis S3.
+        orders_layout (str): L'organisation des commandes sur S3.
+        data_source (str): La source des datasets nettoyés ("raw" ou "gold").
 
     Returns:
-        dict: Un objet JSON représentant la clé Google chargée depuis le fichier.
+        DatasetStore: Le magasin partagé par toutes les sessions.
     """
-    conn = st.experimental_connection("s3", type=FilesConnection)
-    return conn.read(
-        f"{bucket_name}/{file_name}",
-        input_format="json",  # Modifier le format d'entrée en 'json'
-        ttl=600,
-    )
+    shared = None
+    if shared_memory_dir is not None:
+        shared = SharedFrames(shared_memory_dir, max_age=refresh_interval)
+    store = DatasetStore(dataset_loaders(), shared=shared)
+    # Les données sont rechargées en arrière-plan : les sessions lisent la version
+    # précédente jusqu'à ce que la nouvelle soit prête
+    store.start_refresher(refresh_interval)
+    return store
 
 
-# Mode de fonctionnement (Codespaces ou production en ligne)
-mode = "production"  # Vous pouvez définir ceci en fonction de votre environnement
+store = get_dataset_store(mode, bucket_name, orders_layout, data_source)
 
-# Nom du seau S3
-bucket_name = "one-data-lake"
-
-# Liste des noms de fichiers à télécharger depuis S3
-file_names = [
-    "csv_database/orders.csv",
-    "csv_database/ltv_data.csv",
-    # "csv_database/users_2023.csv",
-    "csv_database/customer_geolocalisation.csv",
-    "key_google_json/key_google.json",
-]
-
-# Dictionnaire pour stocker les DataFrames correspondants aux fichiers
-dataframes = {}
-
-# Charger les secrets
-secrets = load_secrets()
-
-# Charger key_google.json en tant qu'objet JSON
-if mode == "production":
-    key_google_json = load_key_google_json_with_connection(
-        bucket_name, "key_google_json/key_google.json"
-    )
-else:
-    key_google_json = load_key_google_json_with_json_key(
-        secrets, bucket_name, "key_google_json/key_google.json"
-    )
-
-# Charger les données depuis S3 en fonction du mode
-for file_name in file_names:
-    if "key_google_json" not in file_name:
-        df_name = file_name.rsplit("/", 1)[-1].split(".")[
-            0
-        ]  # Obtenir le nom du DataFrame
-        if mode == "production":
-            dataframes[df_name] = load_data_from_s3_with_connection(
-                bucket_name, file_name
-            )
-        else:
-            dataframes[df_name] = load_data_from_s3_with_toml(
-                secrets, bucket_name, file_name
-            )
-
-# Créer un DataFrame à partir des données
-orders = dataframes["orders"]
-ltv_data = dataframes["ltv_data"]
-# users = dataframes["users_2023"]
-geoloc_wilaya = dataframes["customer_geolocalisation"]
+# Les commandes sont utilisées par la page par défaut ; les autres datasets sont lus
+# depuis le magasin par les pages qui en ont besoin. Les DataFrames du magasin sont
+# partagés : ils ne doivent pas être modifiés
+with st.spinner("Chargement des données..."):
+    orders = store["orders"]
 
 # %%
 pd.set_option("display.max_columns", None)
 pd.set_option("display.precision", 0)
 
-orders["order_id"] = orders["order_id"].astype(str)
-orders["customer_id"] = orders["customer_id"].astype(str)
-orders["date"] = pd.to_datetime(orders["date"])
-orders = orders.rename(columns={"job_status": "Status"})
-orders = orders[~orders["Status"].isin(["ABANDONED"])]
-orders["customer_id"] = [
-    re.sub(r"\.0$", "", customer_id) for customer_id in orders["customer_id"]
-]
-orders["businessCat"] = orders["businessCat"].replace(
-    ["Recharge mobile", "Recharge mobile / ADSL"], ["Airtime", "Airtime"]
-)
-
-orders = orders[
-    ~orders["order_id"].isin(
-        [
-            "734138951872",
-            "811738356736",
-            "648042957760",
-            "239046556928",
-            "423486580736",
-            "536463465088",
-        ]
-    )
-]
-orders = orders[
-    ~orders["customer_id"].isin(
-        [
-            "2059318",
-            "1506025442",
-            "1694397201",
-            "2830181885",
-            "5620828389",
-            "4064611739",
-            "3385745613",
-            "2281370",
-            "64438759505",
-            "569994573568",
-            "1628682",
-            "310179181696",
-            "878446",
-            "3643707",
-            "2253354",
-            "1771017743",
-            "727840660224",
-            "2280761953",
-            "2864429",
-            "1505970032",
-            "1517116",
-            "929482210496",
-            "5884716233",
-            "22781605568",
-            "2794629",
-            "47201675489",
-            "6072524763",
-            "2342577",
-            "1440074",
-            "3666483",
-            "449701472960",
-            "869120",
-            "7304625963",
-            "2214784702",
-            "869883",
-            "2851778338",
-            "3000794",
-            "1898245261",
-            "9816298466",
-            "7021529167",
-            "3017838801",
-            "5624710564",
-            "1584024035",
-            "2485567",
-            "2763532338",
-            "841024809600",
-            "1739473",
-            "2183725",
-            "3788062",
-            "23400912794",
-            "150321448192",
-            "461317394880",
-            "2208215",
-            "3669307840",
-            "610335616576",
-            "7478577450",
-            "13153632574",
-            "2815691755",
-            "879984",
-            "3312616",
-            "548088380288",
-            "3526036",
-            "2367635120",
-            "24957125457",
-            "459557812544",
-            "1290757210",
-            "507345740736",
-            "2558315057",
-            "819751",
-            "407181581440",
-            "1412707541",
-            "1419613392",
-            "4068655",
-            "303655560704",
-            "2389210",
-            "2765139",
-            "504153462208",
-            "2100305133",
-            "653243920384",
-            "1253878877",
-            "43255929830",
-        ]
-    )
-]
-orders = orders.rename(columns={"Order Type": "Order_Type"})
-orders.loc[(orders["customer_id"] == "73187559488.0"), "Order_Type"] = "EXTERNE"
-order_payment_screen = orders[
-    ["date", "businessCat", "order_id", "Status", "customer_email"]
-].rename(columns={"customer_email": "email"})
-orders_pmi = orders[orders["Order_Type"] == "EXTERNE"]
-
-ltv_data["total_amount_eur"] = ltv_data["total_amount_dzd"] * ltv_data["EUR"]
-ltv_data = ltv_data[
-    ltv_data["businessCat"].isin(["Airtime", "Alimentation", "Shopping"])
-]
-ltv_data["order_id"] = ltv_data["order_id"].astype(str)
-ltv_data["customer_id"] = ltv_data["customer_id"].astype(str)
-ltv_data = ltv_data[~ltv_data["job_status"].isin(["ABANDONED"])]
-ltv_data = ltv_data[
-    ~ltv_data["order_id"].isin(
-        [
-            "734138951872",
-            "811738356736",
-            "648042957760",
-            "239046556928",
-            "423486580736",
-            "536463465088",
-        ]
-    )
-]
-ltv_data = ltv_data[
-    ~ltv_data["customer_id"].isin(
-        [
-            "2059318.0",
-            "1506025442.0",
-            "1694397201.0",
-            "2830181885.0",
-            "5620828389.0",
-            "4064611739.0",
-            "3385745613.0",
-            "2281370.0",
-            "64438759505.0",
-            "569994573568.0",
-            "1628682.0",
-            "310179181696.0",
-            "878446.0",
-            "3643707.0",
-            "2253354.0",
-            "1771017743.0",
-            "727840660224.0",
-            "2280761953.0",
-            "2864429.0",
-            "1505970032.0",
-            "1517116.0",
-            "929482210496.0",
-            "5884716233.0",
-            "22781605568.0",
-            "2794629.0",
-            "47201675489.0",
-            "6072524763.0",
-            "2342577.0",
-            "1440074.0",
-            "3666483.0",
-            "449701472960.0",
-            "869120.0",
-            "7304625963.0",
-            "2214784702.0",
-            "869883.0",
-            "2851778338.0",
-            "3000794.0",
-            "1898245261.0",
-            "9816298466.0",
-            "7021529167.0",
-            "3017838801.0",
-            "5624710564.0",
-            "1584024035.0",
-            "2485567.0",
-            "2763532338.0",
-            "841024809600.0",
-            "1739473.0",
-            "2183725.0",
-            "3788062.0",
-            "23400912794.0",
-            "150321448192.0",
-            "461317394880.0",
-            "2208215.0",
-            "3669307840.0",
-            "610335616576.0",
-            "7478577450.0",
-            "13153632574.0",
-            "2815691755.0",
-            "879984.0",
-            "3312616.0",
-            "548088380288.0",
-            "3526036.0",
-            "2367635120.0",
-            "24957125457.0",
-            "459557812544.0",
-            "1290757210.0",
-            "507345740736.0",
-            "2558315057.0",
-            "819751.0",
-            "407181581440.0",
-            "1412707541.0",
-            "1419613392.0",
-            "4068655.0",
-            "303655560704.0",
-            "2389210.0",
-            "2765139.0",
-            "504153462208.0",
-            "2100305133.0",
-            "653243920384.0",
-            "1253878877.0",
-            "43255929830.0",
-        ]
-    )
-]
-
-ltv_data = ltv_data[ltv_data["job_status"] == "COMPLETED"]
-
 # users["customer_id"] = users["customer_id"].astype(str)
 # users["customer_id"] = [
 #     re.sub(r"\.0$", "", customer_id) for customer_id in users["customer_id"]
@@ -591,40 +371,12 @@ ltv_data = ltv_data[ltv_data["job_status"] == "COMPLETED"]
 
 # st.dataframe(new_signups_checkout)
 
-# %%
-# Filtrer le DataFrame pour ne contenir que les colonnes nécessaires
-orders["date"] = pd.to_datetime(orders["date"])
-
-orders = orders[
-    [
-        "date",
-        "Status",
-        "customer_origine",
-        "paymentType",
-        "order_id",
-        "Order_Type",
-        "businessCat",
-        "customer_id",
-        "Occurence",
-        "previous_order_date",
-        "returning_customer",
-        "customer_username",
-        "customer_phone",
-        "customer_email",
-        "total_amount_dzd",
-    ]
-]
-
-orders = orders[orders["businessCat"].notnull()]
-
 # %%
 # Créez une base de données utilisateur
-# Accédez aux informations de l'utilisateur depuis les secrets
-user1_username = st.secrets["st_utilisateurs_1"]["st_username"]
-user1_password = st.secrets["st_utilisateurs_1"]["st_password"]
-
-user2_username = st.secrets["st_utilisateurs_2"]["st_username"]
-user2_password = st.secrets["st_utilisateurs_2"]["st_password"]
+# Les mots de passe hachés (st_password_hash) sont lus depuis les secrets : bcrypt
+# n'est plus exécuté à chaque rerun, seulement à la connexion
+with timed("user_db"):
+    user_db = load_user_db(st.secrets)
 
 
 # Fonction de connexion
@@ -632,44 +384,21 @@ def login(user_db):
     """
     Gère le processus de connexion en demandant à l'utilisateur de saisir un nom d'utilisateur et un mot de passe.
 
+    Une connexion réussie enregistre un jeton de session signé : les reruns suivants
+    de la session ne refont ni le formulaire ni la vérification bcrypt.
+
     Args:
         user_db (dict): Un dictionnaire contenant les informations des utilisateurs, y compris les mots de passe hachés.
 
     Returns:
-        bool: True si la connexion est réussie, False sinon.
+        bool: True si la session est connectée, False sinon.
     """
-    st.title("Connexion")
-    username = st.text_input("Nom d'utilisateur")
-    password = st.text_input("Mot de passe", type="password")
-
-    if st.button("Se connecter"):
-        if username in user_db:
-            hashed_password = user_db[username]["mot_de_passe"]
-            if bcrypt.checkpw(password.encode(), hashed_password):
-                st.success("Connexion réussie !")
-                return True
-            else:
-                st.error("Nom d'utilisateur ou mot de passe incorrect.")
-        else:
-            st.error("Nom d'utilisateur non trouvé.")
-
-    return False
-
-
-# Créez un dictionnaire user_db avec les informations d'utilisateur hachées
-user_db = {
-    user1_username: {
-        "mot_de_passe": bcrypt.hashpw(user1_password.encode(), bcrypt.gensalt())
-    },
-    user2_username: {
-        "mot_de_passe": bcrypt.hashpw(user2_password.encode(), bcrypt.gensalt())
-    },
-}
+    return auth.login(user_db)
 
 
 def verify_credentials(username, password):
     """
-    Vérifie les informations d'identification de l'utilisateur.
+    Vérifie les informations d'identification de l'utilisateur et ouvre sa session.
 
     Args:
         username (str): Le nom d'utilisateur à vérifier.
@@ -677,23 +406,18 @@ def verify_credentials(username, password):
 
     Returns:
         bool: True si les informations d'identification sont valides, False sinon.
-    Raises:
-            KeyError: Si le nom d'utilisateur n'est pas trouvé dans la base de données.
     """
-    if username in user_db:
-        hashed_password = user_db[username]["mot_de_passe"]
-        return bcrypt.checkpw(password.encode(), hashed_password)
-    return False
+    return auth.verify_credentials(user_db, username, password)
 
 
-# Fonction pour appliquer les filtres
-@st.cache_data
-def apply_filters(df, customer_origine, business_cat, start_date, end_date):
+# Fonctions pour appliquer les filtres : les datasets sont interrogés par leur index
+# (construit une fois par version des données dans le magasin)
+def apply_filters(index, customer_origine, business_cat, start_date, end_date):
     """
     Applique des filtres au DataFrame en fonction des critères spécifiés.
 
     Args:
-        df (pd.DataFrame): Le DataFrame d'origine.
+        index (FilterIndex): L'index de filtrage du dataset (voir `FilterIndex`).
         customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
         business_cat (str): La valeur de la colonne "businessCat" à filtrer.
         start_date (str): La date de début pour la plage de dates à filtrer.
@@ -703,46 +427,72 @@ def apply_filters(df, customer_origine, business_cat, start_date, end_date):
         pd.DataFrame: Un nouveau DataFrame contenant les données filtrées.
 
     Raises:
-        ValueError: Si les colonnes spécifiées pour le filtrage n'existent pas dans le DataFrame.
+        KeyError: Si les colonnes spécifiées pour le filtrage ne sont pas indexées.
     """
-    filtered_data = df.copy()
+    return index.select(
+        start_date,
+        end_date,
+        **equality_filters(customer_origine=customer_origine, businessCat=business_cat),
+    )
 
-    # if status != "Tous":
-    #     filtered_data = filtered_data[filtered_data["Status"] == status]
 
-    if customer_origine != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_origine"] == customer_origine
-        ]
+def apply_filters_ltv(index, customer_origine, business_cat, start_date, end_date):
+    """
+    Applique des filtres au DataFrame pour le calcul de la valeur à vie (LTV).
+
+    Args:
+        index (FilterIndex): L'index de filtrage du dataset (voir `FilterIndex`).
+        customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
+        business_cat (str): La valeur de la colonne "businessCat" à filtrer.
+        start_date (str): La date de début pour la plage de dates à filtrer.
+        end_date (str): La date de fin pour la plage de dates à filtrer.
 
-    if business_cat != "Toutes":
-        filtered_data = filtered_data[filtered_data["businessCat"] == business_cat]
+    Returns:
+        pd.DataFrame: Un nouveau DataFrame contenant les données filtrées.
 
-    date_col = "date"
+    Notes:
+        - Cette fonction est généralement utilisée pour filtrer les données avant de calculer le LTV.
+    """
+    return index.select(
+        start_date,
+        end_date,
+        **equality_filters(customer_origine=customer_origine, businessCat=business_cat),
+    )
 
-    # Convertir start_date et end_date en datetime64[ns]
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
 
-    # Convertir la colonne de dates en datetime64[ns]
-    filtered_data[date_col] = pd.to_datetime(filtered_data[date_col])
+def apply_filters_summary(index, customer_origine, start_date, end_date):
+    """
+    Applique des filtres au DataFrame pour résumer les données.
 
-    # Filtrer les données en fonction de la plage de dates sélectionnée
-    filtered_data = filtered_data[
-        (filtered_data[date_col] >= start_date) & (filtered_data[date_col] <= end_date)
-    ]
+    Args:
+        index (FilterIndex): L'index de filtrage du dataset (voir `FilterIndex`).
+        customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
+        start_date (str): La date de début pour la plage de dates à filtrer.
+        end_date (str): La date de fin pour la plage de dates à filtrer.
+
+    Returns:
+        pd.DataFrame: Un nouveau DataFrame contenant les données filtrées.
 
-    return filtered_data.copy()
+    Notes:
+        - Cette fonction est généralement utilisée pour filtrer les données avant de créer un résumé.
+    """
+    return index.select(
+        start_date,
+        end_date,
+        **equality_filters(customer_origine=customer_origine),
+    )
 
 
-def apply_filters_ltv(df, customer_origine, business_cat, start_date, end_date):
+def apply_filters_users(
+    index, customer_origine, customer_country, start_date, end_date
+):
     """
-    Applique des filtres au DataFrame pour le calcul de la valeur à vie (LTV).
+    Applique des filtres au DataFrame pour résumer les données des utilisateurs.
 
     Args:
-        df (pd.DataFrame): Le DataFrame d'origine.
+        index (FilterIndex): L'index de filtrage du dataset (voir `FilterIndex`).
         customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
-        business_cat (str): La valeur de la colonne "businessCat" à filtrer.
+        customer_country (str): La valeur de la colonne "customer_country" à filtrer.
         start_date (str): La date de début pour la plage de dates à filtrer.
         end_date (str): La date de fin pour la plage de dates à filtrer.
 
@@ -750,119 +500,215 @@ def apply_filters_ltv(df, customer_origine, business_cat, start_date, end_date):
         pd.DataFrame: Un nouveau DataFrame contenant les données filtrées.
 
     Notes:
-        - Cette fonction est généralement utilisée pour filtrer les données avant de calculer le LTV.
+        - Cette fonction est généralement utilisée pour filtrer les données avant de créer un résumé des utilisateurs.
     """
-    filtered_data = df.copy()
-
-    if customer_origine != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_origine"] == customer_origine
-        ]
-
-    if business_cat != "Toutes":
-        filtered_data = filtered_data[filtered_data["businessCat"] == business_cat]
+    return index.select(
+        start_date,
+        end_date,
+        **equality_filters(
+            customer_origine=customer_origine, customer_country=customer_country
+        ),
+    )
 
-    date_col = "date"
 
-    # Convertir start_date et end_date en datetime64[ns]
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
+# %%
+def retention_cohorts(activity, customer_origine, business_cat, start_date, end_date):
+    """
+    Calcule la matrice des cohortes des commandes finalisées qui vérifient les filtres.
 
-    # Convertir la colonne de dates en datetime64[ns]
-    filtered_data[date_col] = pd.to_datetime(filtered_data[date_col])
+    La matrice est lue dans l'index d'activité client x mois, sans parcourir les
+    commandes (voir `ActivityIndex.cohort_pivot`).
 
-    # Filtrer les données en fonction de la plage de dates sélectionnée
-    filtered_data = filtered_data[
-        (filtered_data[date_col] >= start_date) & (filtered_data[date_col] <= end_date)
-    ]
+    Args:
+        activity (ActivityIndex): L'index d'activité des commandes.
+        customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
+        business_cat (str): La valeur de la colonne "businessCat" à filtrer.
+        start_date (str): La date de début pour la plage de dates à filtrer.
+        end_date (str): La date de fin pour la plage de dates à filtrer.
 
-    return filtered_data.copy()
+    Returns:
+        pd.DataFrame: La matrice des cohortes (voir `ActivityIndex.cohort_pivot`).
+    """
+    return activity.cohort_pivot(
+        start_date,
+        end_date,
+        **equality_filters(customer_origine=customer_origine, businessCat=business_cat),
+    )
 
 
-def apply_filters_summary(df, customer_origine, start_date, end_date):
+def orders_kpis(cube, customer_origine, business_cat, start_date, end_date):
     """
-    Applique des filtres au DataFrame pour résumer les données.
+    Calcule les indicateurs des commandes finalisées à partir du cube journalier.
 
     Args:
-        df (pd.DataFrame): Le DataFrame d'origine.
+        cube (OrdersCube): Le cube des commandes.
         customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
+        business_cat (str): La valeur de la colonne "businessCat" à filtrer.
         start_date (str): La date de début pour la plage de dates à filtrer.
         end_date (str): La date de fin pour la plage de dates à filtrer.
 
     Returns:
-        pd.DataFrame: Un nouveau DataFrame contenant les données filtrées.
-
-    Notes:
-        - Cette fonction est généralement utilisée pour filtrer les données avant de créer un résumé.
+        dict: Le nombre de commandes, la GMV en DZD, le nombre de clients distincts et
+            le nombre de nouveaux clients.
     """
-    filtered_data = df.copy()
+    equals = equality_filters(
+        customer_origine=customer_origine, businessCat=business_cat
+    )
+    totals = cube.totals(start_date, end_date, Status="COMPLETED", **equals)
+    return {
+        "orders": totals["orders"],
+        "gmv_dzd": totals["total_amount_dzd"],
+        "customers": cube.distinct_customers(
+            start_date, end_date, Status="COMPLETED", **equals
+        ),
+        "new_customers": cube.new_customers(start_date, end_date, **equals),
+    }
 
-    if customer_origine != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_origine"] == customer_origine
-        ]
 
-    date_col = "date"
+def compute_ltv(orders):
+    """
+    Calcule la valeur à vie (LTV) de chaque client à partir de ses commandes.
 
-    # Convertir start_date et end_date en datetime64[ns]
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
+    Les clients qui n'ont commandé qu'un seul jour (durée de vie nulle) sont écartés.
 
-    # Convertir la colonne de dates en datetime64[ns]
-    filtered_data[date_col] = pd.to_datetime(filtered_data[date_col])
+    Args:
+        orders (pd.DataFrame): Les commandes de la table LTV.
 
-    # Filtrer les données en fonction de la plage de dates sélectionnée
-    filtered_data = filtered_data[
-        (filtered_data[date_col] >= start_date) & (filtered_data[date_col] <= end_date)
+    Returns:
+        pd.DataFrame: Une ligne par client : commandes, chiffre d'affaires, marge, durée
+            de vie, paniers moyens, fréquence d'achat et LTV.
+    """
+    # Grouper les commandes par 'customer_id' et calculer le nombre de commandes et le montant total dépensé pour chaque client
+    ltv_df = orders.groupby("customer_id").agg(
+        {
+            "order_id": "count",
+            "total_amount_dzd": "sum",
+            "total_amount_eur": "sum",
+            "marge_dzd": "sum",
+            "marge_eur": "sum",
+            "date": ["min", "max"],
+        }
+    )
+    ltv_df.columns = [
+        "Nombre de commandes",
+        "Chiffre d'affaire en dzd",
+        "Chiffre d'affaire en €",
+        "Marge DZD",
+        "Marge EUR",
+        "min_date",
+        "max_date",
     ]
 
-    return filtered_data.copy()
+    ltv_df = ltv_df.reset_index()
+
+    # Calculer la durée de vie de chaque client en mois
+    ltv_df["Durée de vie d’un client (lifetime)"] = (
+        ltv_df["max_date"] - ltv_df["min_date"]
+    ).dt.days / 30
+
+    # Supprimer les clients ayant une durée de vie nulle (uniquement une commande)
+    ltv_df = ltv_df[ltv_df["Durée de vie d’un client (lifetime)"] > 0]
 
+    # Diviser le montant total dépensé par le nombre de commandes pour obtenir la valeur moyenne des commandes
+    ltv_df["Panier moyen en dzd"] = (
+        ltv_df["Chiffre d'affaire en dzd"] / ltv_df["Nombre de commandes"]
+    )
+
+    ltv_df["Panier moyen en €"] = (
+        ltv_df["Chiffre d'affaire en €"] / ltv_df["Nombre de commandes"]
+    )
+
+    ltv_df["Panier moyen (marge en dzd)"] = (
+        ltv_df["Marge DZD"] / ltv_df["Nombre de commandes"]
+    )
+
+    ltv_df["Panier moyen (marge en €)"] = (
+        ltv_df["Marge EUR"] / ltv_df["Nombre de commandes"]
+    )
+
+    # Diviser le nombre de commandes par la durée de vie de chaque client pour obtenir la fréquence d'achat
+    ltv_df["Fréquence d’achat"] = (
+        ltv_df["Nombre de commandes"] / ltv_df["Durée de vie d’un client (lifetime)"]
+    )
 
-def apply_filters_users(df, customer_origine, customer_country, start_date, end_date):
+    # Calculer la LTV en multipliant la fréquence d'achat par la valeur moyenne des commandes et en multipliant le résultat par la durée de vie du client en mois
+    ltv_df["LTV (GMV en dzd)"] = (
+        ltv_df["Fréquence d’achat"]
+        * ltv_df["Panier moyen en dzd"]
+        * ltv_df["Durée de vie d’un client (lifetime)"]
+    )
+
+    ltv_df["LTV (GMV en €)"] = (
+        ltv_df["Fréquence d’achat"]
+        * ltv_df["Panier moyen en €"]
+        * ltv_df["Durée de vie d’un client (lifetime)"]
+    )
+
+    ltv_df["LTV (Marge en dzd)"] = (
+        ltv_df["Fréquence d’achat"]
+        * ltv_df["Panier moyen (marge en dzd)"]
+        * ltv_df["Durée de vie d’un client (lifetime)"]
+    )
+
+    ltv_df["LTV (Marge en €)"] = (
+        ltv_df["Fréquence d’achat"]
+        * ltv_df["Panier moyen (marge en €)"]
+        * ltv_df["Durée de vie d’un client (lifetime)"]
+    )
+    return ltv_df
+
+
+def ltv_table(index, customer_origine, business_cat, start_date, end_date):
     """
-    Applique des filtres au DataFrame pour résumer les données des utilisateurs.
+    Calcule la LTV de chaque client sur les commandes qui vérifient les filtres.
 
     Args:
-        df (pd.DataFrame): Le DataFrame d'origine.
+        index (FilterIndex): L'index de filtrage de la table LTV.
         customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
-        customer_country (str): La valeur de la colonne "customer_country" à filtrer.
+        business_cat (str): La valeur de la colonne "businessCat" à filtrer.
         start_date (str): La date de début pour la plage de dates à filtrer.
         end_date (str): La date de fin pour la plage de dates à filtrer.
 
     Returns:
-        pd.DataFrame: Un nouveau DataFrame contenant les données filtrées.
-
-    Notes:
-        - Cette fonction est généralement utilisée pour filtrer les données avant de créer un résumé des utilisateurs.
+        pd.DataFrame: La LTV de chaque client (voir `compute_ltv`).
     """
-    filtered_data = df.copy()
-
-    if customer_origine != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_origine"] == customer_origine
-        ]
+    return compute_ltv(
+        apply_filters_ltv(index, customer_origine, business_cat, start_date, end_date)
+    )
 
-    if customer_country != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_country"] == customer_country
-        ]
 
-    date_col = "date"
+def ltv_by_business_cat(index, customer_origine, start_date, end_date):
+    """
+    Calcule la LTV de chaque client dans chaque Business Catégorie.
 
-    # Convertir start_date et end_date en datetime64[ns]
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
+    Args:
+        index (FilterIndex): L'index de filtrage de la table LTV.
+        customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
+        start_date (str): La date de début pour la plage de dates à filtrer.
+        end_date (str): La date de fin pour la plage de dates à filtrer.
 
-    # Convertir la colonne de dates en datetime64[ns]
-    filtered_data[date_col] = pd.to_datetime(filtered_data[date_col])
+    Returns:
+        pd.DataFrame: La LTV de chaque client (voir `compute_ltv`), une ligne par client
+            et par Business Catégorie (colonne "businessCat").
+    """
+    filtered_data_ltv_summary = apply_filters_summary(
+        index, customer_origine, start_date, end_date
+    )
 
-    # Filtrer les données en fonction de la plage de dates sélectionnée
-    filtered_data = filtered_data[
-        (filtered_data[date_col] >= start_date) & (filtered_data[date_col] <= end_date)
-    ]
+    # Parcourir chaque Business Catégorie et calculer la LTV
+    ltv_results = []
+    for business_cat in filtered_data_ltv_summary["businessCat"].unique():
+        ltv_df_summary_cat = compute_ltv(
+            filtered_data_ltv_summary[
+                filtered_data_ltv_summary["businessCat"] == business_cat
+            ]
+        )
+        # Ajouter une colonne "businessCat" pour indiquer la Business Catégorie
+        ltv_df_summary_cat["businessCat"] = business_cat
+        ltv_results.append(ltv_df_summary_cat)
 
-    return filtered_data.copy()
+    # Concaténer les résultats de toutes les catégories en un seul DataFrame
+    return pd.concat(ltv_results, ignore_index=True)
 
 
 # Créer une application Streamlit
@@ -908,6 +754,17 @@ def main():
         ],
     )
 
+    # Version des données affichées et ancienneté du dernier rafraîchissement
+    st.sidebar.caption(
+        f"Données version {store.version}, "
+        f"mises à jour il y a {int(store.age() // 60)} min"
+    )
+
+    # Rapport des temps de démarrage (administration)
+    if show_timing_panel:
+        with st.sidebar.expander("Temps de chargement"):
+            st.dataframe(stage_report(), hide_index=True)
+
     ####################################################################################   RETENTION PAGES   #####################################################################
 
     if selected_page == "Retention":
@@ -939,8 +796,9 @@ def main():
         business_cat = st.sidebar.selectbox("Business catégorie", business_cat_options)
 
         # Appliquer les filtres
-        filtered_data = apply_filters(
-            orders,
+        filtered_data = store.cached(
+            "orders_index",
+            apply_filters,
             customer_origine,
             business_cat,
             start_date,
@@ -980,30 +838,34 @@ def main():
         # Afficher la plage de dates sélectionnée
         st.sidebar.write(f"Plage de dates sélectionnée : du {start_date} au {end_date}")
 
-        # Calculer et afficher l'analyse de cohorte
-        st.subheader("Analyse de Cohorte")
-        filtered_data.dropna(subset=["customer_id"], inplace=True)
-        # filtered_data["date"] = pd.to_datetime(filtered_data["date"])
-
-        filtered_data["order_period"] = filtered_data["date"].dt.to_period("M")
-        filtered_data["cohort"] = (
-            filtered_data.groupby("customer_id")["date"]
-            .transform("min")
-            .dt.to_period("M")
+        # Indicateurs des commandes finalisées (cube journalier)
+        kpis = store.cached(
+            "orders_cube",
+            orders_kpis,
+            customer_origine,
+            business_cat,
+            start_date,
+            end_date,
         )
-
-        filtered_data_cohort = (
-            filtered_data.groupby(["cohort", "order_period"])
-            .agg(n_customers=("customer_id", "nunique"))
-            .reset_index(drop=False)
+        kpi_orders, kpi_gmv, kpi_customers, kpi_new = st.columns(4)
+        kpi_orders.metric("Commandes", f"{kpis['orders']:,}".replace(",", " "))
+        kpi_gmv.metric("GMV (DZD)", f"{kpis['gmv_dzd']:,.0f}".replace(",", " "))
+        kpi_customers.metric(
+            "Clients distincts", f"{kpis['customers']:,}".replace(",", " ")
+        )
+        kpi_new.metric(
+            "Nouveaux clients", f"{kpis['new_customers']:,}".replace(",", " ")
         )
 
-        filtered_data_cohort["period_number"] = (
-            filtered_data_cohort["order_period"] - filtered_data_cohort["cohort"]
-        ).apply(attrgetter("n"))
-
-        cohort_pivot = filtered_data_cohort.pivot_table(
-            index="cohort", columns="period_number", values="n_customers"
+        # Calculer et afficher l'analyse de cohorte
+        st.subheader("Analyse de Cohorte")
+        cohort_pivot = store.cached(
+            "orders_activity",
+            retention_cohorts,
+            customer_origine,
+            business_cat,
+            start_date,
+            end_date,
         )
 
         # Calculer les clients qui ont abandonné (churn) pour chaque cohort
@@ -1067,7 +929,9 @@ def main():
                         font=dict(color=font_color),
                     )
 
-        # Créez la heatmap de la matrice du nombre de clients
+        # Créez la heatmap de la matrice du nombre de clients (sur une copie : la
+        # matrice en cache est partagée par toutes les sessions)
+        cohort_pivot = cohort_pivot.copy()
         cohort_pivot.index = cohort_pivot.index.strftime("%Y-%m")
         cohort_pivot.columns = cohort_pivot.columns.astype(str)
 
@@ -1133,6 +997,9 @@ def main():
 
     # Créez une nouvelle page LTV
     elif selected_page == "Lifetime Value (LTV)":
+        with st.spinner("Chargement des données LTV..."):
+            ltv_data = store["ltv_data"]
+
         st.header("Lifetime Value (LTV)")
 
         # Sidebar pour les filtres
@@ -1159,94 +1026,16 @@ def main():
         business_cat_options = ["Toutes"] + list(ltv_data["businessCat"].unique())
         business_cat = st.sidebar.selectbox("Business catégorie", business_cat_options)
 
-        # Appliquer les filtres
-        filtered_data_ltv = apply_filters_ltv(
-            ltv_data,
+        # Appliquer les filtres et calculer la LTV de chaque client
+        ltv_df = store.cached(
+            "ltv_data_index",
+            ltv_table,
             customer_origine,
             business_cat,
             start_date,
             end_date,
         )
 
-        # Grouper les commandes par 'customer_id' et calculer le nombre de commandes et le montant total dépensé pour chaque client sur les données filtrées
-        ltv_df = filtered_data_ltv.groupby("customer_id").agg(
-            {
-                "order_id": "count",
-                "total_amount_dzd": "sum",
-                "total_amount_eur": "sum",
-                "marge_dzd": "sum",
-                "marge_eur": "sum",
-                "date": ["min", "max"],
-            }
-        )
-        ltv_df.columns = [
-            "Nombre de commandes",
-            "Chiffre d'affaire en dzd",
-            "Chiffre d'affaire en €",
-            "Marge DZD",
-            "Marge EUR",
-            "min_date",
-            "max_date",
-        ]
-
-        ltv_df = ltv_df.reset_index()
-
-        # Calculer la durée de vie de chaque client en mois sur les données filtrées
-        ltv_df["Durée de vie d’un client (lifetime)"] = (
-            ltv_df["max_date"] - ltv_df["min_date"]
-        ).dt.days / 30
-
-        # Supprimer les clients ayant une durée de vie nulle (uniquement une commande) sur les données filtrées
-        ltv_df = ltv_df[ltv_df["Durée de vie d’un client (lifetime)"] > 0]
-
-        # Diviser le montant total dépensé par le nombre de commandes pour obtenir la valeur moyenne des commandes sur les données filtrées
-        ltv_df["Panier moyen en dzd"] = (
-            ltv_df["Chiffre d'affaire en dzd"] / ltv_df["Nombre de commandes"]
-        )
-
-        ltv_df["Panier moyen en €"] = (
-            ltv_df["Chiffre d'affaire en €"] / ltv_df["Nombre de commandes"]
-        )
-
-        ltv_df["Panier moyen (marge en dzd)"] = (
-            ltv_df["Marge DZD"] / ltv_df["Nombre de commandes"]
-        )
-
-        ltv_df["Panier moyen (marge en €)"] = (
-            ltv_df["Marge EUR"] / ltv_df["Nombre de commandes"]
-        )
-
-        # Diviser le nombre de commandes par la durée de vie de chaque client pour obtenir la fréquence d'achat sur les données filtrées
-        ltv_df["Fréquence d’achat"] = (
-            ltv_df["Nombre de commandes"]
-            / ltv_df["Durée de vie d’un client (lifetime)"]
-        )
-
-        # Calculer la LTV en multipliant la fréquence d'achat par la valeur moyenne des commandes et en multipliant le résultat par la durée de vie du client en mois sur les données filtrées
-        ltv_df["LTV (GMV en dzd)"] = (
-            ltv_df["Fréquence d’achat"]
-            * ltv_df["Panier moyen en dzd"]
-            * ltv_df["Durée de vie d’un client (lifetime)"]
-        )
-
-        ltv_df["LTV (GMV en €)"] = (
-            ltv_df["Fréquence d’achat"]
-            * ltv_df["Panier moyen en €"]
-            * ltv_df["Durée de vie d’un client (lifetime)"]
-        )
-
-        ltv_df["LTV (Marge en dzd)"] = (
-            ltv_df["Fréquence d’achat"]
-            * ltv_df["Panier moyen (marge en dzd)"]
-            * ltv_df["Durée de vie d’un client (lifetime)"]
-        )
-
-        ltv_df["LTV (Marge en €)"] = (
-            ltv_df["Fréquence d’achat"]
-            * ltv_df["Panier moyen (marge en €)"]
-            * ltv_df["Durée de vie d’un client (lifetime)"]
-        )
-
         # Afficher les données filtrées
         show_ltv_df = st.sidebar.checkbox("Afficher les données")
 
@@ -1275,126 +1064,18 @@ def main():
                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             )
 
-        # Appliquer les filtres
-        filtered_data_ltv_summary = apply_filters_summary(
-            ltv_data,
+        # Afficher la plage de dates sélectionnée
+        st.sidebar.write(f"Plage de dates sélectionnée : du {start_date} au {end_date}")
+
+        # LTV de chaque client, par Business Catégorie
+        ltv_summary_df = store.cached(
+            "ltv_data_index",
+            ltv_by_business_cat,
             customer_origine,
             start_date,
             end_date,
         )
 
-        # Afficher la plage de dates sélectionnée
-        st.sidebar.write(f"Plage de dates sélectionnée : du {start_date} au {end_date}")
-
-        # Liste unique de catégories d'entreprise
-        business_cats = filtered_data_ltv_summary["businessCat"].unique()
-
-        # Initialiser une liste pour stocker les résultats par Business Catégorie
-        ltv_results = []
-
-        # Parcourir chaque Business Catégorie et calculer la LTV
-        for business_cat in business_cats:
-            # Filtrer les données pour la Business Catégorie actuelle
-            ltv_cat_df = filtered_data_ltv_summary[
-                filtered_data_ltv_summary["businessCat"] == business_cat
-            ]
-
-            # Grouper les commandes par 'customer_id' et calculer le nombre de commandes et le montant total dépensé pour chaque client sur les données filtrées
-            ltv_df_summary_cat = ltv_cat_df.groupby("customer_id").agg(
-                {
-                    "order_id": "count",
-                    "total_amount_dzd": "sum",
-                    "total_amount_eur": "sum",
-                    "marge_dzd": "sum",
-                    "marge_eur": "sum",
-                    "date": ["min", "max"],
-                }
-            )
-
-            ltv_df_summary_cat.columns = [
-                "Nombre de commandes",
-                "Chiffre d'affaire en dzd",
-                "Chiffre d'affaire en €",
-                "Marge DZD",
-                "Marge EUR",
-                "min_date",
-                "max_date",
-            ]
-
-            ltv_df_summary_cat = ltv_df_summary_cat.reset_index()
-            # Calculer la durée de vie de chaque client en mois sur les données filtrées
-            ltv_df_summary_cat["Durée de vie d’un client (lifetime)"] = (
-                ltv_df_summary_cat["max_date"] - ltv_df_summary_cat["min_date"]
-            ).dt.days / 30
-
-            # Supprimer les clients ayant une durée de vie nulle (uniquement une commande) sur les données filtrées
-            ltv_df_summary_cat = ltv_df_summary_cat[
-                ltv_df_summary_cat["Durée de vie d’un client (lifetime)"] > 0
-            ]
-
-            # Diviser le montant total dépensé par le nombre de commandes pour obtenir la valeur moyenne des commandes sur les données filtrées
-
-            ltv_df_summary_cat["Panier moyen en dzd"] = (
-                ltv_df_summary_cat["Chiffre d'affaire en dzd"]
-                / ltv_df_summary_cat["Nombre de commandes"]
-            )
-
-            ltv_df_summary_cat["Panier moyen en €"] = (
-                ltv_df_summary_cat["Chiffre d'affaire en €"]
-                / ltv_df_summary_cat["Nombre de commandes"]
-            )
-
-            ltv_df_summary_cat["Panier moyen (marge en dzd)"] = (
-                ltv_df_summary_cat["Marge DZD"]
-                / ltv_df_summary_cat["Nombre de commandes"]
-            )
-
-            ltv_df_summary_cat["Panier moyen (marge en €)"] = (
-                ltv_df_summary_cat["Marge EUR"]
-                / ltv_df_summary_cat["Nombre de commandes"]
-            )
-
-            # Diviser le nombre de commandes par la durée de vie de chaque client pour obtenir la fréquence d'achat sur les données filtrées
-            ltv_df_summary_cat["Fréquence d’achat"] = (
-                ltv_df_summary_cat["Nombre de commandes"]
-                / ltv_df_summary_cat["Durée de vie d’un client (lifetime)"]
-            )
-
-            # Calculer la LTV en multipliant la fréquence d'achat par la valeur moyenne des commandes et en multipliant le résultat par la durée de vie du client en mois sur les données filtrées
-
-            ltv_df_summary_cat["LTV (GMV en dzd)"] = (
-                ltv_df_summary_cat["Fréquence d’achat"]
-                * ltv_df_summary_cat["Panier moyen en dzd"]
-                * ltv_df_summary_cat["Durée de vie d’un client (lifetime)"]
-            )
-
-            ltv_df_summary_cat["LTV (GMV en €)"] = (
-                ltv_df_summary_cat["Fréquence d’achat"]
-                * ltv_df_summary_cat["Panier moyen en €"]
-                * ltv_df_summary_cat["Durée de vie d’un client (lifetime)"]
-            )
-
-            ltv_df_summary_cat["LTV (Marge en dzd)"] = (
-                ltv_df_summary_cat["Fréquence d’achat"]
-                * ltv_df_summary_cat["Panier moyen (marge en dzd)"]
-                * ltv_df_summary_cat["Durée de vie d’un client (lifetime)"]
-            )
-
-            ltv_df_summary_cat["LTV (Marge en €)"] = (
-                ltv_df_summary_cat["Fréquence d’achat"]
-                * ltv_df_summary_cat["Panier moyen (marge en €)"]
-                * ltv_df_summary_cat["Durée de vie d’un client (lifetime)"]
-            )
-
-            # Ajouter une colonne "businessCat" pour indiquer la Business Catégorie
-            ltv_df_summary_cat["businessCat"] = business_cat
-
-            # Ajouter les résultats au tableau de résultats
-            ltv_results.append(ltv_df_summary_cat)
-
-        # Concaténer les résultats de toutes les catégories en un seul DataFrame
-        ltv_summary_df = pd.concat(ltv_results, ignore_index=True)
-
         # Réorganiser les colonnes si nécessaire
         ltv_summary_df = ltv_summary_df[
             [
@@ -1973,6 +1654,9 @@ def main():
 
     # Créez une nouvelle page concentration des clients
     elif selected_page == "Concentration des clients par commune, Algérie":
+        with st.spinner("Chargement des données de géolocalisation..."):
+            geoloc_wilaya = store["customer_geolocalisation"]
+
         st.header("Concentration des clients par commune, Algérie")
 
         # Créez une liste des régions (wilayas) pour le filtre
@@ -2139,4 +1823,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Une ligne de journal structurée par exécution du script
+        log_run("temtemOneDash", run_started)
@@ -1,467 +1,281 @@
 # %%
 from datetime import datetime, timedelta
-import os
-from io import StringIO
 from io import BytesIO
-import re
-import json
+import time
 import pandas as pd
-import boto3
-import bcrypt
 import xlsxwriter
-from st_files_connection import FilesConnection
 import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
-import toml
+from temtemOneData import load_file, load_partitioned_dataset
+from temtemOneStorage import get_backend
+from temtemOneCleaning import (
+    ORDERS_RAW_COLUMNS,
+    USERS_COLUMNS,
+    clean_orders,
+    clean_users,
+)
+from temtemOneStore import DatasetStore, SharedFrames
+from temtemOneEtl import gold_file_name
+import temtemOneAuth as auth
+from temtemOneAuth import load_user_db
+from temtemOneFilters import FilterIndex, equality_filters
+from temtemOneTiming import timed, timed_step, stage_report, log_run
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
-
 # %%
-# Fonction pour charger les secrets depuis le fichier secrets.toml
-def load_secrets():
-    """
-    Charge les secrets depuis le fichier 'secrets.toml'.
-
-    Returns:
-        dict: Un dictionnaire contenant les secrets chargés.
-    """
-    # Obtenez le chemin complet vers le fichier secrets.toml
-    secrets_file_path = os.path.join(".streamlit", "secrets.toml")
+# Mode de fonctionnement (Codespaces ou production en ligne)
+# "production" : connexion Streamlit, "local" : copie locale du bucket (profilage, tests
+# de charge, sans accès réseau), sinon boto3 avec les secrets de .streamlit/secrets.toml
+mode = "production"  # Vous pouvez définir ceci en fonction de votre environnement
 
-    # Chargez le fichier secrets.toml
-    secrets = toml.load(secrets_file_path)
+# Nom du seau S3
+bucket_name = "one-data-lake"
 
-    return secrets
+# Copie locale du seau (même arborescence), utilisée en mode "local"
+local_data_dir = "one-data-lake"
 
+# Organisation des commandes sur S3 : "monolithic" (csv_database/orders.csv) ou
+# "partitioned" (un fichier par mois : csv_database/orders/2024-05.csv, ...)
+orders_layout = "monolithic"
+orders_prefix = "csv_database/orders/"
 
-# Fonction pour charger les données depuis S3 en utilisant les secrets du fichier toml
-@st.cache_data
-def load_data_from_s3_with_toml(secrets, bucket_name, file_name):
-    """
-    Charge les données depuis un fichier stocké sur Amazon S3 en utilisant les informations de connexion fournies.
+# Source des datasets nettoyés : "raw" (CSV nettoyés dans l'application) ou "gold"
+# (Parquet déjà nettoyés publiés par l'ETL : python -m temtemOneEtl)
+data_source = "raw"
+gold_prefix = "gold/"
 
-    Args:
-        secrets (dict): Un dictionnaire contenant les informations d'identification AWS.
-        bucket_name (str): Le nom du bucket S3.
-        file_name (str): Le nom du fichier à charger depuis S3.
+# Intervalle (en secondes) entre deux rafraîchissements des données en arrière-plan
+refresh_interval = 600
 
-    Returns:
-        pd.DataFrame: Un DataFrame Pandas contenant les données du fichier chargé depuis S3.
-    """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=secrets["s3_credentials"]["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=secrets["s3_credentials"]["AWS_SECRET_ACCESS_KEY"],
-    )
-    response = s3_client.get_object(Bucket=bucket_name, Key=file_name)
-    object_content = response["Body"].read().decode("utf-8")
-    return pd.read_csv(StringIO(object_content), delimiter=",", low_memory=False)
+# Répertoire partagé par les processus Streamlit de la machine (ex. "/dev/shm/temtem") :
+# les DataFrames nettoyés y sont publiés en Arrow IPC et mappés en mémoire par tous
+# les processus. None : chaque processus garde ses propres DataFrames
+shared_memory_dir = None
 
+# Panneau d'administration dans la barre latérale : temps, lignes et mémoire de chaque
+# étape du chargement (les temps sont aussi écrits dans le journal à chaque exécution)
+show_timing_panel = False
 
-# Fonction pour charger les données depuis S3 en utilisant experimental_connection
-def load_data_from_s3_with_connection(bucket_name, file_name):
-    """
-    Charge les données depuis un fichier stocké sur Amazon S3 en utilisant la connexion expérimentale Streamlit.
+# Début de l'exécution du script, pour la ligne de journal des temps de démarrage
+run_started = time.perf_counter()
 
-    Args:
-        bucket_name (str): Le nom du bucket S3.
-        file_name (str): Le nom du fichier à charger depuis S3.
+# Fichiers à télécharger depuis S3, par dataset
+file_names = {
+    "orders": "csv_database/orders.csv",
+    "users_2023": "csv_database/users_2023.csv",
+    "key_google": "key_google_json/key_google.json",
+}
 
-    Returns:
-        pd.DataFrame: Un DataFrame Pandas contenant les données du fichier chargé depuis S3.
-    """
-    conn = st.experimental_connection("s3", type=FilesConnection)
-    return conn.read(
-        f"{bucket_name}/{file_name}",
-        input_format="csv",
-        ttl=600,
-        low_memory=False,
-    )
+# Colonnes utilisées par l'application, par dataset : seules ces colonnes sont lues depuis S3
+columns = {
+    "orders": ORDERS_RAW_COLUMNS,
+    "users_2023": USERS_COLUMNS,
+}
 
 
-# Fonction pour charger key_google.json depuis S3 en tant qu'objet JSON
-def load_key_google_json_with_json_key(secrets, bucket_name, file_name):
+def load_google_sheets(store):
     """
-    Charge une clé JSON Google depuis un fichier stocké sur Amazon S3 en utilisant les informations de connexion S3.
+    Lit les feuilles Google Sheets utilisées par la page "ACQUISITION".
 
     Args:
-        secrets (dict): Un dictionnaire contenant les informations de connexion S3.
-        bucket_name (str): Le nom du bucket S3.
-        file_name (str): Le nom du fichier à charger depuis S3.
+        store (DatasetStore): Le magasin, pour la clé Google et les utilisateurs.
 
     Returns:
-        dict: Un objet JSON représentant la clé Google chargée depuis le fichier.
-    """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=secrets["s3_credentials"]["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=secrets["s3_credentials"]["AWS_SECRET_ACCESS_KEY"],
-    )
-    response = s3_client.get_object(Bucket=bucket_name, Key=file_name)
-    object_content = response["Body"].read().decode("utf-8")
-
-    # Utilisez la bibliothèque json pour charger le contenu en tant qu'objet JSON
-    return json.loads(object_content)
+        dict: Un dictionnaire avec les DataFrames "telechargement", "first_open_data" et
+            "new_signups_first_open_data".
 
-
-def load_key_google_json_with_connection(bucket_name, file_name):
+    Raises:
+        gspread.exceptions.SpreadsheetNotFound: Si la feuille "Téléchargement" est introuvable.
     """
-    Charge une clé JSON Google depuis un fichier stocké sur Amazon S3 en utilisant la connexion expérimentale Streamlit.
+    # key_google_json contient le contenu du fichier key_google.json que vous avez chargé depuis S3
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(store["key_google"])
 
-    Args:
-        bucket_name (str): Le nom du bucket S3.
-        file_name (str): Le nom du fichier à charger depuis S3.
+    # Autoriser l'accès à Google Sheets en utilisant les informations d'authentification
+    with timed("gspread:authorize"):
+        gc = gspread.authorize(creds)
 
-    Returns:
-        dict: Un objet JSON représentant la clé Google chargée depuis le fichier.
-    """
-    conn = st.experimental_connection("s3", type=FilesConnection)
-    return conn.read(
-        f"{bucket_name}/{file_name}",
-        input_format="json",  # Modifier le format d'entrée en 'json'
-        ttl=600,
+    # Ouvrez la feuille Google Sheets par son nom
+    spreadsheet_name = "Téléchargement"  # Remplacez par le nom de votre feuille
+    worksheet_name = (
+        "telechargement"  # Remplacez par le nom de l'onglet que vous souhaitez lire
     )
 
+    try:
+        with timed(f"gspread:{spreadsheet_name}") as stage:
+            spreadsheet = gc.open(spreadsheet_name)
+            worksheet = spreadsheet.worksheet(worksheet_name)
+            # Lire les données de la feuille Google Sheets en tant que DataFrame pandas
+            telechargement = stage.output(pd.DataFrame(worksheet.get_all_records()))
+    except gspread.exceptions.SpreadsheetNotFound as exc:
+        # Le chargeur peut tourner dans le thread de rafraîchissement (sans contexte
+        # Streamlit) : l'erreur est affichée par la page. Rien n'est gardé dans le
+        # magasin : la lecture sera retentée au prochain rerun
+        raise gspread.exceptions.SpreadsheetNotFound(
+            f"La feuille '{spreadsheet_name}' ou l'onglet '{worksheet_name}' n'a pas été trouvé."
+        ) from exc
+
+    # Liste des noms de feuilles
+    sheet_names = [
+        "First_open_date_2020-2021",
+        "First_open_date_2021-2022",
+        "First_open_date_2022-2023",
+    ]
 
-# Mode de fonctionnement (Codespaces ou production en ligne)
-mode = "production"  # Vous pouvez définir ceci en fonction de votre environnement
+    # Initialiser une liste pour stocker les DataFrames
+    dfs = []
 
-# Nom du seau S3
-bucket_name = "one-data-lake"
+    # Parcourir les feuilles et les stocker dans la liste
+    for sheet_name in sheet_names:
+        with timed(f"gspread:{sheet_name}") as stage:
+            spreadsheet = gc.open(sheet_name)
 
-# Liste des noms de fichiers à télécharger depuis S3
-file_names = [
-    "csv_database/orders.csv",
-    "csv_database/users_2023.csv",
-    "key_google_json/key_google.json",
-]
+            # Accès à l'onglet spécifique
+            worksheet = spreadsheet.worksheet("First_open_email")
 
-# Dictionnaire pour stocker les DataFrames correspondants aux fichiers
-dataframes = {}
+            # Lire les données de l'onglet
+            data = worksheet.get_all_values()
+            stage.output(len(data))
 
-# Charger les secrets
-secrets = load_secrets()
+        # Créer un DataFrame à partir des données
+        df = pd.DataFrame(data)
 
-# Charger key_google.json en tant qu'objet JSON
-if mode == "production":
-    key_google_json = load_key_google_json_with_connection(
-        bucket_name, "key_google_json/key_google.json"
-    )
-else:
-    key_google_json = load_key_google_json_with_json_key(
-        secrets, bucket_name, "key_google_json/key_google.json"
-    )
+        # Définir la première ligne comme en-tête
+        df.columns = df.iloc[0]
+        df = df[1:]
 
-# Charger les données depuis S3 en fonction du mode
-for file_name in file_names:
-    if "key_google_json" not in file_name:
-        df_name = file_name.split("/")[-1].split(".")[0]  # Obtenir le nom du DataFrame
-        if mode == "production":
-            dataframes[df_name] = load_data_from_s3_with_connection(
-                bucket_name, file_name
-            )
-        else:
-            dataframes[df_name] = load_data_from_s3_with_toml(
-                secrets, bucket_name, file_name
-            )
-
-# Créer un DataFrame à partir des données
-orders = dataframes["orders"]
-users = dataframes["users_2023"]
-
-# %%
-pd.set_option("display.max_columns", None)
-pd.set_option("display.precision", 0)
-
-orders["order_id"] = orders["order_id"].astype(str)
-orders["customer_id"] = orders["customer_id"].astype(str)
-orders["date"] = pd.to_datetime(orders["date"])
-orders = orders.rename(columns={"job_status": "Status"})
-orders = orders[~orders["Status"].isin(["ABANDONED"])]
-orders["customer_id"] = [
-    re.sub(r"\.0$", "", customer_id) for customer_id in orders["customer_id"]
-]
-orders["businessCat"] = orders["businessCat"].replace(
-    ["Recharge mobile", "Recharge mobile / ADSL"], ["Airtime", "Airtime"]
-)
+        # Ajouter le DataFrame à la liste
+        dfs.append(df)
 
-orders = orders[
-    ~orders["order_id"].isin(
-        [
-            "734138951872",
-            "811738356736",
-            "648042957760",
-            "239046556928",
-            "423486580736",
-            "536463465088",
-        ]
-    )
-]
-orders = orders[
-    ~orders["customer_id"].isin(
-        [
-            "2059318",
-            "1506025442",
-            "1694397201",
-            "2830181885",
-            "5620828389",
-            "4064611739",
-            "3385745613",
-            "2281370",
-            "64438759505",
-            "569994573568",
-            "1628682",
-            "310179181696",
-            "878446",
-            "3643707",
-            "2253354",
-            "1771017743",
-            "727840660224",
-            "2280761953",
-            "2864429",
-            "1505970032",
-            "1517116",
-            "929482210496",
-            "5884716233",
-            "22781605568",
-            "2794629",
-            "47201675489",
-            "6072524763",
-            "2342577",
-            "1440074",
-            "3666483",
-            "449701472960",
-            "869120",
-            "7304625963",
-            "2214784702",
-            "869883",
-            "2851778338",
-            "3000794",
-            "1898245261",
-            "9816298466",
-            "7021529167",
-            "3017838801",
-            "5624710564",
-            "1584024035",
-            "2485567",
-            "2763532338",
-            "841024809600",
-            "1739473",
-            "2183725",
-            "3788062",
-            "23400912794",
-            "150321448192",
-            "461317394880",
-            "2208215",
-            "3669307840",
-            "610335616576",
-            "7478577450",
-            "13153632574",
-            "2815691755",
-            "879984",
-            "3312616",
-            "548088380288",
-            "3526036",
-            "2367635120",
-            "24957125457",
-            "459557812544",
-            "1290757210",
-            "507345740736",
-            "2558315057",
-            "819751",
-            "407181581440",
-            "1412707541",
-            "1419613392",
-            "4068655",
-            "303655560704",
-            "2389210",
-            "2765139",
-            "504153462208",
-            "2100305133",
-            "653243920384",
-            "1253878877",
-            "43255929830",
-        ]
+    # Concaténer tous les DataFrames dans un seul DataFrame
+    first_open_data = pd.concat(dfs, ignore_index=True).drop_duplicates(
+        subset="email", keep="first"
     )
-]
-orders = orders.rename(columns={"Order Type": "Order_Type"})
-orders.loc[(orders["customer_id"] == "73187559488.0"), "Order_Type"] = "EXTERNE"
-
-order_payment_screen = orders[
-    ["date", "businessCat", "order_id", "Status", "customer_email"]
-].rename(columns={"customer_email": "email"})
-orders_pmi = orders[orders["Order_Type"] == "EXTERNE"]
-
-users["customer_id"] = users["customer_id"].astype(str)
-users["customer_id"] = [
-    re.sub(r"\.0$", "", customer_id) for customer_id in users["customer_id"]
-]
-users["tags"] = users["tags"].str.replace(r"\[|\]", "", regex=True)
-users["tags"] = users["tags"].str.replace(r"['\"]", "", regex=True)
-users = users[
-    ~users["customer_id"].isin(
-        [
-            "2059318",
-            "1506025442",
-            "1694397201",
-            "2830181885",
-            "5620828389",
-            "4064611739",
-            "3385745613",
-            "2281370",
-            "64438759505",
-            "569994573568",
-            "1628682",
-            "310179181696",
-            "878446",
-            "3643707",
-            "2253354",
-            "1771017743",
-            "727840660224",
-            "2280761953",
-            "2864429",
-            "1505970032",
-            "1517116",
-            "929482210496",
-            "5884716233",
-            "22781605568",
-            "2794629",
-            "47201675489",
-            "6072524763",
-            "2342577",
-            "1440074",
-            "3666483",
-            "449701472960",
-            "869120",
-            "7304625963",
-            "2214784702",
-            "869883",
-            "2851778338",
-            "3000794",
-            "1898245261",
-            "9816298466",
-            "7021529167",
-            "3017838801",
-            "5624710564",
-            "1584024035",
-            "2485567",
-            "2763532338",
-            "841024809600",
-            "1739473",
-            "2183725",
-            "3788062",
-            "23400912794",
-            "150321448192",
-            "461317394880",
-            "2208215",
-            "3669307840",
-            "610335616576",
-            "7478577450",
-            "13153632574",
-            "2815691755",
-            "879984",
-            "3312616",
-            "548088380288",
-            "3526036",
-            "2367635120",
-            "24957125457",
-            "459557812544",
-            "1290757210",
-            "507345740736",
-            "2558315057",
-            "819751",
-            "407181581440",
-            "1412707541",
-            "1419613392",
-            "4068655",
-            "303655560704",
-            "2389210",
-            "2765139",
-            "504153462208",
-            "2100305133",
-            "653243920384",
-            "1253878877",
-            "43255929830",
-        ]
+    new_signups_first_open_data = pd.merge(
+        store["users_info"], first_open_data, how="inner", on="email"
     )
-]
 
-users["date"] = pd.to_datetime(users["date"])
-users["date"] = users["date"].dt.strftime("%Y-%m-%d")
-users["date"] = pd.to_datetime(users["date"])
-users = users.rename(columns={"Origine": "customer_origine"})
-users_info = users[["date", "email", "phone", "customer_origine", "customer_id"]]
-
-# users_info_payment_screen = users[
-#     ["date", "email", "phone", "customer_origine", "customer_id"]
-# ].rename(columns={"date": "date_registration"})
+    return {
+        "telechargement": telechargement,
+        "first_open_data": first_open_data,
+        "new_signups_first_open_data": new_signups_first_open_data,
+    }
 
-# key_google_json contient le contenu du fichier key_google.json que vous avez chargé depuis S3
-creds = ServiceAccountCredentials.from_json_keyfile_dict(key_google_json)
 
-# Autoriser l'accès à Google Sheets en utilisant les informations d'authentification
-gc = gspread.authorize(creds)
+def dataset_loaders():
+    """
+    Déclare comment charger et nettoyer chaque dataset de l'application.
 
-# Ouvrez la feuille Google Sheets par son nom
-spreadsheet_name = "Téléchargement"  # Remplacez par le nom de votre feuille
-worksheet_name = (
-    "telechargement"  # Remplacez par le nom de l'onglet que vous souhaitez lire
-)
+    Les datasets sont chargés à la demande par le magasin : les utilisateurs et les
+    feuilles Google Sheets ne sont lus qu'à l'ouverture de la page "ACQUISITION".
 
-try:
-    spreadsheet = gc.open(spreadsheet_name)
-    worksheet = spreadsheet.worksheet(worksheet_name)
-    # Lire les données de la feuille Google Sheets en tant que DataFrame pandas
-    telechargement = pd.DataFrame(worksheet.get_all_records())
+    Returns:
+        dict: Un dictionnaire {nom du dataset: fonction de chargement}.
+    """
+    # Backend de stockage choisi par le mode (S3 ou copie locale)
+    backend = get_backend(mode, bucket_name, local_data_dir)
+
+    def load(name):
+        return load_file(backend, file_names[name], columns.get(name))
+
+    def load_cleaned(name, clean, source=None):
+        if data_source == "gold":
+            # Dataset déjà nettoyé et typé par l'ETL : rien à nettoyer ici
+            return load_file(backend, gold_file_name(name, gold_prefix))
+        return timed_step(f"clean:{name}", clean)(load(source or name))
+
+    # Nettoyage mesuré (temps, lignes et mémoire) pour le rapport de démarrage
+    clean_orders_timed = timed_step("clean:orders", clean_orders)
+
+    def load_orders(store):
+        if data_source == "gold":
+            return load_cleaned("orders", clean_orders)
+        if orders_layout == "partitioned":
+            # Seules les partitions nouvelles ou modifiées sont téléchargées et nettoyées
+            return load_partitioned_dataset(
+                backend, orders_prefix, clean_orders_timed, columns["orders"]
+            )
+        return clean_orders_timed(load("orders"))
+
+    def load_order_payment_screen(store):
+        orders = store["orders"]
+        return orders[
+            ["date", "businessCat", "order_id", "Status", "customer_email"]
+        ].rename(columns={"customer_email": "email"})
+
+    def load_orders_pmi(store):
+        orders = store["orders"]
+        return orders[orders["Order_Type"] == "EXTERNE"]
+
+    def load_users_info(store):
+        users = store["users"]
+        return users[["date", "email", "phone", "customer_origine", "customer_id"]]
+
+    return {
+        "orders": load_orders,
+        "order_payment_screen": load_order_payment_screen,
+        "orders_pmi": load_orders_pmi,
+        "users": lambda store: load_cleaned("users", clean_users, "users_2023"),
+        "users_info": load_users_info,
+        # key_google.json est chargé en tant qu'objet JSON
+        "key_google": lambda store: load("key_google"),
+        "google_sheets": load_google_sheets,
+        # Index de filtrage (dates triées, positions par valeur des listes déroulantes)
+        "users_index": lambda store: FilterIndex(
+            store["users"], ["customer_origine", "customer_country"]
+        ),
+        "telechargement_index": lambda store: FilterIndex(
+            store["google_sheets"]["telechargement"], ["customer_origine"]
+        ),
+        "new_signups_first_open_index": lambda store: FilterIndex(
+            store["google_sheets"]["new_signups_first_open_data"], ["customer_origine"]
+        ),
+    }
 
-    # st.title("Lecture de la feuille Google Sheets")
 
-    # # Affichez les données de la feuille Google Sheets en tant que tableau
-    # st.table(telechargement)
-except gspread.exceptions.SpreadsheetNotFound:
-    st.error(
-        f"La feuille '{spreadsheet_name}' ou l'onglet '{worksheet_name}' n'a pas été trouvé."
-    )
-
-# Liste des noms de feuilles
-sheet_names = [
-    "First_open_date_2020-2021",
-    "First_open_date_2021-2022",
-    "First_open_date_2022-2023",
-]
+# Magasin partagé par toutes les sessions : chaque dataset n'est chargé et nettoyé
+# qu'une fois par processus, et non à chaque rerun du script
+@st.cache_resource
+def get_dataset_store(mode, bucket_name, orders_layout, data_source):
+    """
+    Crée le magasin de datasets du processus (un par configuration de chargement).
 
-# Initialiser une liste pour stocker les DataFrames
-dfs = []
+    Args:
+        mode (str): Le mode de fonctionnement.
+        bucket_name (str): Le nom du bucket S3.
+        orders_layout (str): L'organisation des commandes sur S3.
+        data_source (str): La source des datasets nettoyés ("raw" ou "gold").
 
-# Parcourir les feuilles et les stocker dans la liste
-for sheet_name in sheet_names:
-    spreadsheet = gc.open(sheet_name)
+    Returns:
+        DatasetStore: Le magasin partagé par toutes les sessions.
+    """
+    shared = None
+    if shared_memory_dir is not None:
+        shared = SharedFrames(shared_memory_dir, max_age=refresh_interval)
+    store = DatasetStore(dataset_loaders(), shared=shared, volatile=("google_sheets",))
+    # Les données sont rechargées en arrière-plan : les sessions lisent la version
+    # précédente jusqu'à ce que la nouvelle soit prête
+    store.start_refresher(refresh_interval)
+    return store
 
-    # Accès à l'onglet spécifique
-    worksheet = spreadsheet.worksheet("First_open_email")
 
-    # Lire les données de l'onglet
-    data = worksheet.get_all_values()
+store = get_dataset_store(mode, bucket_name, orders_layout, data_source)
 
-    # Créer un DataFrame à partir des données
-    df = pd.DataFrame(data)
+# Les commandes sont utilisées par toutes les pages ; les autres datasets sont lus
+# depuis le magasin par les pages qui en ont besoin. Les DataFrames du magasin sont
+# partagés : ils ne doivent pas être modifiés
+with st.spinner("Chargement des données..."):
+    orders = store["orders"]
 
-    # Définir la première ligne comme en-tête
-    df.columns = df.iloc[0]
-    df = df[1:]
+# %%
+pd.set_option("display.max_columns", None)
+pd.set_option("display.precision", 0)
 
-    # Ajouter le DataFrame à la liste
-    dfs.append(df)
+# users_info_payment_screen = users[
+#     ["date", "email", "phone", "customer_origine", "customer_id"]
+# ].rename(columns={"date": "date_registration"})
 
-# Concaténer tous les DataFrames dans un seul DataFrame
-first_open_data = pd.concat(dfs, ignore_index=True).drop_duplicates(
-    subset="email", keep="first"
-)
-new_signups_first_open_data = pd.merge(
-    users_info, first_open_data, how="inner", on="email"
-)
 
 # st.dataframe(new_signups_first_open_data)
 
@@ -499,77 +313,34 @@ new_signups_first_open_data = pd.merge(
 
 # st.dataframe(new_signups_checkout)
 
-# %%
-# Filtrer le DataFrame pour ne contenir que les colonnes nécessaires
-orders["date"] = pd.to_datetime(orders["date"])
-
-orders = orders[
-    [
-        "date",
-        "Status",
-        "customer_origine",
-        "paymentType",
-        "order_id",
-        "Order_Type",
-        "businessCat",
-        "customer_id",
-        "Occurence",
-        "previous_order_date",
-        "returning_customer",
-        "customer_username",
-        "customer_phone",
-        "customer_email",
-        "total_amount_dzd",
-    ]
-]
-
-orders = orders[orders["businessCat"].notnull()]
-
 # %%
 # Créez une base de données utilisateur
-# Accédez aux informations de l'utilisateur depuis les secrets
-user1_username = st.secrets["st_utilisateurs_1"]["st_username"]
-user1_password = st.secrets["st_utilisateurs_1"]["st_password"]
-
-user2_username = st.secrets["st_utilisateurs_2"]["st_username"]
-user2_password = st.secrets["st_utilisateurs_2"]["st_password"]
-
-# Créez un dictionnaire user_db avec les informations d'utilisateur hachées
+# Les mots de passe hachés (st_password_hash) sont lus depuis les secrets : bcrypt
+# n'est plus exécuté à chaque rerun, seulement à la connexion
+with timed("user_db"):
+    user_db = load_user_db(st.secrets)
 
 
 # Fonction de connexion
 def login(user_db):
-    st.title("Connexion")
-    username = st.text_input("Nom d'utilisateur")
-    password = st.text_input("Mot de passe", type="password")
-
-    if st.button("Se connecter"):
-        if username in user_db:
-            hashed_password = user_db[username]["mot_de_passe"]
-            if bcrypt.checkpw(password.encode(), hashed_password):
-                st.success("Connexion réussie !")
-                return True
-            else:
-                st.error("Nom d'utilisateur ou mot de passe incorrect.")
-        else:
-            st.error("Nom d'utilisateur non trouvé.")
+    """
+    Gère le processus de connexion en demandant à l'utilisateur de saisir un nom d'utilisateur et un mot de passe.
 
-    return False
+    Une connexion réussie enregistre un jeton de session signé : les reruns suivants
+    de la session ne refont ni le formulaire ni la vérification bcrypt.
 
+    Args:
+        user_db (dict): Un dictionnaire contenant les informations des utilisateurs, y compris les mots de passe hachés.
 
-user_db = {
-    user1_username: {
-        "mot_de_passe": bcrypt.hashpw(user1_password.encode(), bcrypt.gensalt())
-    },
-    user2_username: {
-        "mot_de_passe": bcrypt.hashpw(user2_password.encode(), bcrypt.gensalt())
-    },
-}
+    Returns:
+        bool: True si la session est connectée, False sinon.
+    """
+    return auth.login(user_db)
 
 
 def verify_credentials(username, password):
     """
-    Vérifie les informations d'identification de l'utilisateur.
+    Vérifie les informations d'identification de l'utilisateur et ouvre sa session.
 
     Args:
         username (str): Le nom d'utilisateur à vérifier.
@@ -577,23 +348,18 @@ def verify_credentials(username, password):
 
     Returns:
         bool: True si les informations d'identification sont valides, False sinon.
-    Raises:
-            KeyError: Si le nom d'utilisateur n'est pas trouvé dans la base de données.
     """
-    if username in user_db:
-        hashed_password = user_db[username]["mot_de_passe"]
-        return bcrypt.checkpw(password.encode(), hashed_password)
-    return False
+    return auth.verify_credentials(user_db, username, password)
 
 
-# Fonction pour appliquer les filtres
-@st.cache_data
-def apply_filters(df, customer_origine, business_cat, start_date, end_date):
+# Fonctions pour appliquer les filtres : les datasets sont interrogés par leur index
+# (construit une fois par version des données dans le magasin)
+def apply_filters(index, customer_origine, business_cat, start_date, end_date):
     """
     Applique des filtres au DataFrame en fonction des critères spécifiés.
 
     Args:
-        df (pd.DataFrame): Le DataFrame d'origine.
+        index (FilterIndex): L'index de filtrage du dataset (voir `FilterIndex`).
         customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
         business_cat (str): La valeur de la colonne "businessCat" à filtrer.
         start_date (str): La date de début pour la plage de dates à filtrer.
@@ -603,44 +369,21 @@ def apply_filters(df, customer_origine, business_cat, start_date, end_date):
         pd.DataFrame: Un nouveau DataFrame contenant les données filtrées.
 
     Raises:
-        ValueError: Si les colonnes spécifiées pour le filtrage n'existent pas dans le DataFrame.
+        KeyError: Si les colonnes spécifiées pour le filtrage ne sont pas indexées.
     """
-    filtered_data = df.copy()
-
-    # if status != "Tous":
-    #     filtered_data = filtered_data[filtered_data["Status"] == status]
-
-    if customer_origine != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_origine"] == customer_origine
-        ]
-
-    if business_cat != "Toutes":
-        filtered_data = filtered_data[filtered_data["businessCat"] == business_cat]
-
-    date_col = "date"
-
-    # Convertir start_date et end_date en datetime64[ns]
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-
-    # Convertir la colonne de dates en datetime64[ns]
-    filtered_data[date_col] = pd.to_datetime(filtered_data[date_col])
-
-    # Filtrer les données en fonction de la plage de dates sélectionnée
-    filtered_data = filtered_data[
-        (filtered_data[date_col] >= start_date) & (filtered_data[date_col] <= end_date)
-    ]
-
-    return filtered_data.copy()
+    return index.select(
+        start_date,
+        end_date,
+        **equality_filters(customer_origine=customer_origine, businessCat=business_cat),
+    )
 
 
-def apply_filters_summary(df, customer_origine, start_date, end_date):
+def apply_filters_summary(index, customer_origine, start_date, end_date):
     """
     Applique des filtres au DataFrame pour résumer les données.
 
     Args:
-        df (pd.DataFrame): Le DataFrame d'origine.
+        index (FilterIndex): L'index de filtrage du dataset (voir `FilterIndex`).
         customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
         start_date (str): La date de début pour la plage de dates à filtrer.
         end_date (str): La date de fin pour la plage de dates à filtrer.
@@ -651,28 +394,11 @@ def apply_filters_summary(df, customer_origine, start_date, end_date):
     Notes:
         - Cette fonction est généralement utilisée pour filtrer les données avant de créer un résumé.
     """
-    filtered_data = df.copy()
-
-    if customer_origine != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_origine"] == customer_origine
-        ]
-
-    date_col = "date"
-
-    # Convertir start_date et end_date en datetime64[ns]
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-
-    # Convertir la colonne de dates en datetime64[ns]
-    filtered_data[date_col] = pd.to_datetime(filtered_data[date_col])
-
-    # Filtrer les données en fonction de la plage de dates sélectionnée
-    filtered_data = filtered_data[
-        (filtered_data[date_col] >= start_date) & (filtered_data[date_col] <= end_date)
-    ]
-
-    return filtered_data.copy()
+    return index.select(
+        start_date,
+        end_date,
+        **equality_filters(customer_origine=customer_origine),
+    )
 
 
 # def apply_filters_checkout(df, customer_origine, start_date, end_date):
@@ -700,12 +426,14 @@ def apply_filters_summary(df, customer_origine, start_date, end_date):
 #     return filtered_data.copy()
 
 
-def apply_filters_users(df, customer_origine, customer_country, start_date, end_date):
+def apply_filters_users(
+    index, customer_origine, customer_country, start_date, end_date
+):
     """
     Applique des filtres au DataFrame pour résumer les données des utilisateurs.
 
     Args:
-        df (pd.DataFrame): Le DataFrame d'origine.
+        index (FilterIndex): L'index de filtrage du dataset (voir `FilterIndex`).
         customer_origine (str): La valeur de la colonne "customer_origine" à filtrer.
         customer_country (str): La valeur de la colonne "customer_country" à filtrer.
         start_date (str): La date de début pour la plage de dates à filtrer.
@@ -717,33 +445,13 @@ def apply_filters_users(df, customer_origine, customer_country, start_date, end_
     Notes:
         - Cette fonction est généralement utilisée pour filtrer les données avant de créer un résumé des utilisateurs.
     """
-    filtered_data = df.copy()
-
-    if customer_origine != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_origine"] == customer_origine
-        ]
-
-    if customer_country != "Tous":
-        filtered_data = filtered_data[
-            filtered_data["customer_country"] == customer_country
-        ]
-
-    date_col = "date"
-
-    # Convertir start_date et end_date en datetime64[ns]
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-
-    # Convertir la colonne de dates en datetime64[ns]
-    filtered_data[date_col] = pd.to_datetime(filtered_data[date_col])
-
-    # Filtrer les données en fonction de la plage de dates sélectionnée
-    filtered_data = filtered_data[
-        (filtered_data[date_col] >= start_date) & (filtered_data[date_col] <= end_date)
-    ]
-
-    return filtered_data.copy()
+    return index.select(
+        start_date,
+        end_date,
+        **equality_filters(
+            customer_origine=customer_origine, customer_country=customer_country
+        ),
+    )
 
 
 # Créer une application Streamlit
@@ -785,10 +493,38 @@ def main():
         ["ACQUISITION", "RETARGETING"],
     )
 
+    # Version des données affichées et ancienneté du dernier rafraîchissement
+    st.sidebar.caption(
+        f"Données version {store.version}, "
+        f"mises à jour il y a {int(store.age() // 60)} min"
+    )
+
+    # Rapport des temps de démarrage (administration)
+    if show_timing_panel:
+        with st.sidebar.expander("Temps de chargement"):
+            st.dataframe(stage_report(), hide_index=True)
+
     ####################################################################################   NOUVEAUX INSCRITS PAGES   #####################################################################
 
     # Créez une nouvelle page Users
     if selected_page == "ACQUISITION":
+        with st.spinner("Chargement des données d'acquisition..."):
+            # Utilisateurs et clé Google en parallèle, puis les feuilles Google Sheets
+            store.preload(["users", "key_google"])
+            users = store["users"]
+            # Feuilles Google Sheets et index de filtrage de la page
+            try:
+                store.preload(
+                    [
+                        "users_index",
+                        "telechargement_index",
+                        "new_signups_first_open_index",
+                    ]
+                )
+            except gspread.exceptions.SpreadsheetNotFound as exc:
+                st.error(str(exc))
+                st.stop()
+
         st.header("ACQUISITION 2023")
 
         # Sidebar pour les filtres
@@ -815,8 +551,9 @@ def main():
         )
 
         # Appliquer les filtres
-        filtered_new_signups = apply_filters_users(
-            users,
+        filtered_new_signups = store.cached(
+            "users_index",
+            apply_filters_users,
             customer_origine,
             customer_country,
             # accountTypes,
@@ -825,15 +562,17 @@ def main():
             end_date,
         )
 
-        filtered_data_download = apply_filters_summary(
-            telechargement,
+        filtered_data_download = store.cached(
+            "telechargement_index",
+            apply_filters_summary,
             customer_origine,
             start_date,
             end_date,
         )
 
-        filtered_new_signups_first_open = apply_filters_summary(
-            new_signups_first_open_data,
+        filtered_new_signups_first_open = store.cached(
+            "new_signups_first_open_index",
+            apply_filters_summary,
             customer_origine,
             start_date,
             end_date,
@@ -1604,4 +1343,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Une ligne de journal structurée par exécution du script
+        log_run("temtemOneDashMarketing", run_started)
@@ -0,0 +1,635 @@
+# %%
+import os
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from pyarrow import parquet as pq
+from temtemOneSchema import (
+    SCHEMAS,
+    arrow_column_types,
+    apply_schema,
+    schema_fingerprint,
+)
+from temtemOneTiming import timed
+
+logger = logging.getLogger(__name__)
+
+# Répertoire local des snapshots colonnaires (un fichier Parquet par dataset et par ETag)
+SNAPSHOT_DIR = os.environ.get(
+    "TEMTEM_SNAPSHOT_DIR", os.path.join(".cache", "snapshots")
+)
+
+# Taille des blocs lus par le parseur CSV Arrow (l'inférence des types se fait sur le premier bloc)
+CSV_BLOCK_SIZE = 8 << 20
+
+# Durée (en secondes) pendant laquelle une frame chargée est réutilisée sans revalider son ETag
+REVALIDATE_AFTER = 600
+
+# Nom des partitions mensuelles d'un dataset partitionné (ex. csv_database/orders/2024-05.csv)
+PARTITION_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+
+# Compressions reconnues, d'après le suffixe de la clé ou l'en-tête Content-Encoding
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+CONTENT_ENCODINGS = {"gzip": "gzip", "x-gzip": "gzip", "zstd": "zstd"}
+
+
+# %%
+def dataset_name(file_name):
+    """
+    Déduit le nom du DataFrame à partir de la clé S3 (ex. "csv_database/orders.csv" -> "orders").
+
+    Pour une partition mensuelle (ex. "csv_database/orders/2024-05.csv"), le nom du
+    dataset est celui du dossier parent.
+
+    Args:
+        file_name (str): La clé du fichier dans le bucket S3.
+
+    Returns:
+        str: Le nom du dataset.
+    """
+    parts = file_name.split("/")
+    name = parts[-1].split(".")[0]
+    if PARTITION_PATTERN.match(name) and len(parts) > 1:
+        return parts[-2]
+    return name
+
+
+def object_name(file_name):
+    """
+    Nom unique d'un objet S3 pour le cache local (ex. "orders" ou "orders@2024-05" pour une partition).
+
+    Args:
+        file_name (str): La clé du fichier dans le bucket S3.
+
+    Returns:
+        str: Le nom de l'objet.
+    """
+    name = file_name.rsplit("/", 1)[-1].split(".")[0]
+    dataset = dataset_name(file_name)
+    return dataset if dataset == name else f"{dataset}@{name}"
+
+
+# %%
+# Fonctions pour le cache local des snapshots Parquet, indexé par l'ETag S3
+def snapshot_variant(file_name, columns=None):
+    """
+    Identifie la variante de parsing d'un dataset (empreinte du schéma déclaré et des colonnes lues).
+
+    Deux snapshots du même objet S3 parsés avec des schémas ou des colonnes différents ne
+    sont pas interchangeables : la variante fait partie du nom du fichier.
+
+    Args:
+        file_name (str): La clé du fichier dans le bucket S3.
+        columns (list, optional): Les colonnes lues (toutes si None).
+
+    Returns:
+        str: L'identifiant de la variante.
+    """
+    return schema_fingerprint(SCHEMAS.get(dataset_name(file_name), {}), columns)
+
+
+def _snapshot_prefix(file_name, variant):
+    return f"{object_name(file_name)}.{variant}-"
+
+
+def snapshot_path(file_name, etag, variant=""):
+    """
+    Construit le chemin du snapshot Parquet correspondant à une version d'un fichier S3.
+
+    Args:
+        file_name (str): La clé du fichier dans le bucket S3.
+        etag (str): L'ETag S3 de l'objet (identifie la version du contenu).
+        variant (str): La variante de parsing (voir `snapshot_variant`).
+
+    Returns:
+        str: Le chemin du fichier Parquet local.
+    """
+    version = etag.strip('"')
+    return os.path.join(
+        SNAPSHOT_DIR, f"{_snapshot_prefix(file_name, variant)}{version}.parquet"
+    )
+
+
+def read_snapshot(file_name, etag, variant=""):
+    """
+    Lit le snapshot Parquet d'un fichier S3 s'il existe pour cet ETag.
+
+    Args:
+        file_name (str): La clé du fichier dans le bucket S3.
+        etag (str): L'ETag S3 actuel de l'objet.
+        variant (str): La variante de parsing (voir `snapshot_variant`).
+
+    Returns:
+        pd.DataFrame or None: Le DataFrame typé, ou None si aucun snapshot valide n'existe.
+    """
+    path = snapshot_path(file_name, etag, variant)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except (ImportError, OSError, ValueError) as exc:
+        logger.warning("Snapshot illisible %s : %s", path, exc)
+        return None
+
+
+def write_snapshot(df, file_name, etag, variant=""):
+    """
+    Écrit le DataFrame parsé en snapshot Parquet et supprime les snapshots obsolètes du dataset.
+
+    L'écriture passe par un fichier temporaire renommé atomiquement, afin qu'un lecteur
+    concurrent ne voie jamais un fichier partiel. Un échec d'écriture (colonnes aux types
+    mixtes non sérialisables, disque plein...) n'interrompt pas le chargement.
+
+    Args:
+        df (pd.DataFrame): Le DataFrame parsé depuis le CSV.
+        file_name (str): La clé du fichier dans le bucket S3.
+        etag (str): L'ETag S3 de l'objet.
+        variant (str): La variante de parsing (voir `snapshot_variant`).
+    """
+    path = snapshot_path(file_name, etag, variant)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    except (ImportError, OSError, ValueError, TypeError, NotImplementedError) as exc:
+        logger.warning("Snapshot non écrit pour %s : %s", file_name, exc)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    # Supprimer les snapshots des versions précédentes du même dataset. Un autre
+    # processus (ou le thread de rafraîchissement) peut les supprimer en même temps :
+    # le chargement, déjà réussi, ne doit pas échouer pour autant
+    prefix = _snapshot_prefix(file_name, variant)
+    for entry in os.listdir(SNAPSHOT_DIR):
+        entry_path = os.path.join(SNAPSHOT_DIR, entry)
+        if (
+            entry.startswith(prefix)
+            and entry.endswith(".parquet")
+            and entry_path != path
+        ):
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+
+
+# %%
+# Fonction pour parser un CSV directement depuis un flux binaire
+def compression_of(file_name, content_encoding=None):
+    """
+    Détecte la compression d'un objet S3 d'après le suffixe de sa clé ou son Content-Encoding.
+
+    Args:
+        file_name (str): La clé du fichier (ex. "csv_database/orders.csv.zst").
+        content_encoding (str, optional): L'en-tête Content-Encoding de l'objet.
+
+    Returns:
+        str | None: "gzip", "zstd" ou None si l'objet n'est pas compressé.
+    """
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if file_name.endswith(suffix):
+            return compression
+    return CONTENT_ENCODINGS.get((content_encoding or "").strip().lower())
+
+
+def decompressed(stream, compression):
+    """
+    Enveloppe un flux binaire dans un flux de décompression Arrow (sans rien lire à l'avance).
+
+    Args:
+        stream: Un objet fichier binaire exposant une méthode `read`.
+        compression (str | None): "gzip", "zstd" ou None.
+
+    Returns:
+        Le flux décompressé, ou `stream` lui-même s'il n'est pas compressé.
+    """
+    if compression is None:
+        return stream
+    if not isinstance(stream, pa.NativeFile):
+        stream = pa.PythonFile(stream, mode="r")
+    return pa.CompressedInputStream(stream, compression)
+
+
+def read_csv_stream(stream, reopen=None, schema=None, columns=None, compression=None):
+    """
+    Parse un CSV depuis un flux binaire (corps de réponse S3, fichier s3fs...) avec le lecteur CSV multi-thread d'Arrow.
+
+    Le contenu brut est gardé dans un seul tampon d'octets (l'objet téléchargé par le
+    backend, ou le fichier mappé en mémoire pour une copie locale) et décodé directement
+    en colonnes Arrow : aucune str Python intermédiaire du contenu n'est créée.
+    Seules les colonnes demandées sont converties (les autres colonnes, notamment les
+    champs texte volumineux, ne sont jamais matérialisées) et les colonnes du schéma
+    déclaré sont typées pendant le parsing. Si la conversion échoue
+    (colonne aux valeurs mixtes au-delà du premier bloc, format de date non ISO), le
+    fichier est relu avec pandas depuis un nouveau flux obtenu par `reopen`.
+
+    Un flux compressé (gzip, zstd) est décompressé au fil de la lecture : le texte
+    décompressé complet n'est jamais placé en mémoire.
+
+    Args:
+        stream: Un objet fichier binaire exposant une méthode `read`.
+        reopen (callable, optional): Une fonction sans argument qui renvoie un nouveau flux
+            binaire sur le même contenu, utilisée pour le repli sur pandas.
+        schema (dict, optional): Le schéma déclaré du dataset (voir `SCHEMAS`).
+        columns (list, optional): Les colonnes à lire (toutes si None).
+        compression (str, optional): "gzip" ou "zstd" si le flux est compressé (voir
+            `compression_of`).
+
+    Returns:
+        pd.DataFrame: Un DataFrame Pandas contenant les données du CSV.
+    """
+    try:
+        table = pa_csv.read_csv(
+            decompressed(stream, compression),
+            read_options=pa_csv.ReadOptions(
+                use_threads=True, block_size=CSV_BLOCK_SIZE
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=columns,
+                column_types=arrow_column_types(schema or {}),
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=True,
+            ),
+        )
+    except pa.ArrowInvalid as exc:
+        if reopen is None:
+            raise
+        logger.warning("Lecture CSV Arrow impossible, repli sur pandas : %s", exc)
+        df = pd.read_csv(
+            decompressed(reopen(), compression),
+            delimiter=",",
+            usecols=columns,
+            low_memory=False,
+        )
+        return apply_schema(df, schema or {})
+    return apply_schema(table.to_pandas(), schema or {}, table)
+
+
+# %%
+# Sources lues par les chargements en cours dans chaque thread (voir `recording_sources`)
+_recording = threading.local()
+
+
+class Source:
+    """
+    Version d'un fichier (ou d'un dataset partitionné) lu pendant la construction d'un dataset.
+
+    Args:
+        version: La version lue (ETag, ETags des partitions ou contenu JSON).
+        revalidate (callable): Une fonction sans argument qui revalide la source
+            immédiatement (sans délai de revalidation) et renvoie sa version actuelle.
+    """
+
+    def __init__(self, version, revalidate):
+        self.version = version
+        self._revalidate = revalidate
+
+    def changed(self):
+        """
+        Revalide la source auprès du stockage.
+
+        Pour un fichier, seul l'ETag est comparé (requête HEAD) : rien n'est téléchargé
+        ni parsé tant que le dataset n'est pas reconstruit.
+
+        Returns:
+            bool: True si la version actuelle diffère de la version lue.
+        """
+        return self._revalidate() != self.version
+
+
+@contextmanager
+def recording_sources():
+    """
+    Enregistre les sources lues dans ce thread pendant la construction d'un dataset.
+
+    Les enregistrements s'imbriquent : un dataset construit pendant la construction
+    d'un autre garde ses propres sources.
+
+    Yields:
+        list: La liste des `Source` lues, complétée au fil des chargements.
+    """
+    stack = getattr(_recording, "stack", None)
+    if stack is None:
+        stack = _recording.stack = []
+    sources = []
+    stack.append(sources)
+    try:
+        yield sources
+    finally:
+        stack.pop()
+
+
+def _record_source(version, revalidate):
+    stack = getattr(_recording, "stack", None)
+    if stack:
+        stack[-1].append(Source(version, revalidate))
+
+
+# Datasets Parquet nettoyés déjà chargés dans ce processus : (stockage, clé, variante)
+# -> {"etag", "df", "checked_at"}. Les frames brutes des CSV ne sont pas gardées : après
+# une revalidation, elles sont relues depuis leur snapshot Parquet local
+_loaded_frames = {}
+
+
+def latest_snapshot_etag(file_name, variant=""):
+    """
+    Retrouve l'ETag du snapshot Parquet le plus récent d'un dataset, s'il en existe un.
+
+    Args:
+        file_name (str): La clé du fichier dans le bucket S3.
+        variant (str): La variante de parsing (voir `snapshot_variant`).
+
+    Returns:
+        str or None: L'ETag (entre guillemets, comme renvoyé par S3), ou None.
+    """
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return None
+    prefix = _snapshot_prefix(file_name, variant)
+    snapshots = [
+        os.path.join(SNAPSHOT_DIR, entry)
+        for entry in os.listdir(SNAPSHOT_DIR)
+        if entry.startswith(prefix) and entry.endswith(".parquet")
+    ]
+    if not snapshots:
+        return None
+    latest = max(snapshots, key=os.path.getmtime)
+    return '"{}"'.format(os.path.basename(latest)[len(prefix) : -len(".parquet")])
+
+
+def _remember_frame(frame_key, etag, df):
+    """
+    Mémorise la frame chargée et son ETag pour les revalidations suivantes.
+
+    Returns:
+        dict: L'entrée du cache {"etag", "df", "checked_at"}.
+    """
+    entry = {"etag": etag, "df": df, "checked_at": time.monotonic()}
+    _loaded_frames[frame_key] = entry
+    return entry
+
+
+def _read_csv(backend, file_name, columns):
+    # Revalide le fichier à partir de l'ETag de son dernier snapshot : le snapshot est
+    # relu s'il n'a pas changé, sinon le CSV est téléchargé, parsé et mis en snapshot
+    variant = snapshot_variant(file_name, columns)
+    etag = latest_snapshot_etag(file_name, variant)
+    name = object_name(file_name)
+    with timed(f"fetch:{name}"):
+        response = backend.fetch(file_name, etag)
+    if response is None:
+        with timed(f"snapshot:{name}") as stage:
+            df = stage.output(read_snapshot(file_name, etag, variant))
+        if df is not None:
+            return etag, df
+        # Snapshot disparu entre-temps : téléchargement complet
+        with timed(f"fetch:{name}"):
+            response = backend.fetch(file_name)
+
+    with timed(f"parse:{name}") as stage:
+        df = stage.output(
+            read_csv_stream(
+                response["Body"],
+                reopen=response["reopen"],
+                schema=SCHEMAS.get(dataset_name(file_name)),
+                columns=columns,
+                compression=compression_of(file_name, response.get("ContentEncoding")),
+            )
+        )
+    write_snapshot(df, file_name, response["ETag"], variant)
+    return response["ETag"], df
+
+
+# Fonction pour charger un CSV depuis le stockage
+def load_csv(backend, file_name, columns=None):
+    """
+    Charge un fichier CSV depuis le backend de stockage en DataFrame typé.
+
+    Chaque appel revalide le fichier (GET conditionnel If-None-Match sur S3) avec l'ETag
+    de son dernier snapshot Parquet local : s'il n'a pas changé, le snapshot est relu ;
+    le CSV n'est téléchargé et parsé que si l'objet a changé. La frame brute n'est pas
+    gardée en mémoire : seul le dataset nettoyé qui en est tiré l'est (dans le magasin).
+
+    Args:
+        backend (StorageBackend): Le backend de stockage (voir `get_backend`).
+        file_name (str): La clé du fichier à charger.
+        columns (list, optional): Les colonnes à lire (toutes si None).
+
+    Returns:
+        pd.DataFrame: Un DataFrame Pandas contenant les données du fichier, propre à
+            l'appelant.
+    """
+    etag, df = _read_csv(backend, file_name, columns)
+    _record_source(etag, lambda: backend.etag(file_name))
+    return df
+
+
+def _parquet_entry(backend, file_name, columns, revalidate_after):
+    frame_key = (backend.name, file_name, f"gold-{schema_fingerprint({}, columns)}")
+    known = _loaded_frames.get(frame_key)
+    if known is not None and time.monotonic() - known["checked_at"] < revalidate_after:
+        return known
+
+    name = object_name(file_name)
+    with timed(f"fetch:{name}"):
+        response = backend.fetch(file_name, known["etag"] if known else None)
+    if response is None:
+        known["checked_at"] = time.monotonic()
+        return known
+
+    with timed(f"parse:{name}") as stage:
+        df = stage.output(
+            pq.read_table(response["Body"], columns=columns).to_pandas(
+                split_blocks=True
+            )
+        )
+    return _remember_frame(frame_key, response["ETag"], df)
+
+
+# Fonction pour charger un dataset Parquet publié par l'ETL
+def load_parquet(backend, file_name, columns=None, revalidate_after=REVALIDATE_AFTER):
+    """
+    Charge un dataset Parquet déjà nettoyé et typé (sortie "gold" de `temtemOneEtl`).
+
+    La frame est gardée en mémoire avec son ETag et revalidée après `revalidate_after`
+    secondes ; le fichier n'est relu que s'il a changé. Les types
+    (catégories, Int64, string[pyarrow], dates) sont repris tels qu'ils ont été écrits :
+    aucun parsing ni nettoyage n'est refait.
+
+    La frame renvoyée est partagée avec le cache : elle doit être traitée en lecture
+    seule (c'est déjà le cas des datasets du magasin).
+
+    Args:
+        backend (StorageBackend): Le backend de stockage (voir `get_backend`).
+        file_name (str): La clé du fichier (ex. "gold/orders.parquet").
+        columns (list, optional): Les colonnes à lire (toutes si None).
+        revalidate_after (int): Durée (en secondes) pendant laquelle la frame en mémoire
+            est réutilisée sans revalidation.
+
+    Returns:
+        pd.DataFrame: Le dataset.
+    """
+    entry = _parquet_entry(backend, file_name, columns, revalidate_after)
+
+    def revalidate():
+        etag = backend.etag(file_name)
+        if etag != entry["etag"]:
+            # Fichier modifié : le prochain chargement le relit sans attendre
+            # `revalidate_after`
+            entry["checked_at"] = float("-inf")
+        return etag
+
+    _record_source(entry["etag"], revalidate)
+    return entry["df"]
+
+
+# %%
+# Fonction pour charger un fichier depuis le stockage
+def load_file(backend, file_name, columns=None):
+    """
+    Charge un fichier : les CSV et les Parquet en DataFrame, les fichiers JSON (clé Google) en dictionnaire.
+
+    Args:
+        backend (StorageBackend): Le backend de stockage (voir `get_backend`).
+        file_name (str): La clé du fichier.
+        columns (list, optional): Les colonnes à lire (toutes si None). Ignoré pour le JSON.
+
+    Returns:
+        pd.DataFrame | dict: Le DataFrame ou l'objet JSON chargé.
+    """
+    if file_name.endswith(".json"):
+        with timed(f"fetch:{object_name(file_name)}"):
+            data = backend.read_json(file_name)
+        # Pas d'ETag pour les fichiers JSON : la version est le contenu lui-même
+        _record_source(data, lambda: backend.read_json(file_name))
+        return data
+    if file_name.endswith(".parquet"):
+        return load_parquet(backend, file_name, columns)
+    return load_csv(backend, file_name, columns)
+
+
+# %%
+# Dataset partitionnés déjà chargés : (stockage, préfixe, variante) -> {"etags", "parts", "df", "checked_at"}
+_partitioned_datasets = {}
+
+
+def list_partitions(backend, prefix):
+    """
+    Liste les partitions mensuelles d'un dataset partitionné et leur ETag.
+
+    Args:
+        backend (StorageBackend): Le backend de stockage (voir `get_backend`).
+        prefix (str): Le préfixe des partitions (ex. "csv_database/orders/").
+
+    Returns:
+        dict: Un dictionnaire {clé de la partition: ETag}.
+    """
+    return {
+        key: etag
+        for key, etag in backend.list(prefix).items()
+        if PARTITION_PATTERN.match(key.rsplit("/", 1)[-1].split(".")[0])
+    }
+
+
+def concat_partitions(parts):
+    """
+    Concatène des partitions nettoyées en conservant les colonnes catégorielles.
+
+    Les partitions n'ont pas les mêmes catégories (un mois sans une valeur donnée) :
+    les catégories sont unies au lieu de laisser pd.concat repasser en type object.
+
+    Args:
+        parts (list): La liste des DataFrames à concaténer, dans l'ordre.
+
+    Returns:
+        pd.DataFrame: Le DataFrame concaténé.
+    """
+    if not parts:
+        return pd.DataFrame()
+    df = pd.concat(parts, ignore_index=True)
+    for column in parts[0].columns:
+        if all(isinstance(part[column].dtype, pd.CategoricalDtype) for part in parts):
+            df[column] = union_categoricals(
+                [part[column] for part in parts], ignore_order=True
+            )
+    return df
+
+
+# Fonction pour charger un dataset partitionné par mois de façon incrémentale
+def load_partitioned_dataset(
+    backend, prefix, clean, columns=None, revalidate_after=REVALIDATE_AFTER
+):
+    """
+    Charge un dataset partitionné par mois (ex. csv_database/orders/2024-05.csv) de façon incrémentale.
+
+    Chaque partition est nettoyée séparément avec `clean` et conservée en mémoire avec son
+    ETag. Lors d'un rechargement, seules les partitions nouvelles ou modifiées (en
+    pratique, le mois en cours) sont téléchargées et nettoyées : le coût d'un
+    rafraîchissement est proportionnel aux nouvelles données, pas à tout l'historique.
+
+    Args:
+        backend (StorageBackend): Le backend de stockage (voir `get_backend`).
+        prefix (str): Le préfixe des partitions (ex. "csv_database/orders/").
+        clean (callable): La fonction de nettoyage appliquée à chaque partition brute.
+            Elle doit travailler ligne par ligne (filtres et transformations de colonnes).
+        columns (list, optional): Les colonnes à lire dans chaque partition (toutes si None).
+        revalidate_after (int): Durée (en secondes) pendant laquelle le dataset en mémoire
+            est réutilisé sans lister à nouveau les partitions.
+
+    Returns:
+        pd.DataFrame: Le dataset nettoyé, partagé entre les appels : il ne doit pas être modifié.
+    """
+    key = (backend.name, prefix, snapshot_variant(prefix.rstrip("/") + ".csv", columns))
+    state = _partitioned_datasets.setdefault(
+        key, {"etags": {}, "parts": {}, "df": None, "checked_at": None}
+    )
+    if (
+        state["df"] is not None
+        and time.monotonic() - state["checked_at"] < revalidate_after
+    ):
+        return state["df"]
+
+    etags = list_partitions(backend, prefix)
+    stale = [
+        file_name
+        for file_name, etag in etags.items()
+        if state["etags"].get(file_name) != etag
+    ]
+    removed = [file_name for file_name in state["parts"] if file_name not in etags]
+
+    def load(file_name):
+        # Seule la partition nettoyée est gardée en mémoire
+        return clean(load_csv(backend, file_name, columns))
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=min(len(stale), 8)) as executor:
+            for file_name, part in zip(stale, executor.map(load, stale)):
+                state["parts"][file_name] = part
+                state["etags"][file_name] = etags[file_name]
+    for file_name in removed:
+        del state["parts"][file_name]
+        del state["etags"][file_name]
+
+    if stale or removed or state["df"] is None:
+        parts = [state["parts"][file_name] for file_name in sorted(state["parts"])]
+        state["df"] = concat_partitions(parts)
+    state["checked_at"] = time.monotonic()
+
+    def revalidate():
+        load_partitioned_dataset(backend, prefix, clean, columns, revalidate_after=0)
+        return _partitions_version(state)
+
+    _record_source(_partitions_version(state), revalidate)
+    return state["df"]
+
+
+def _partitions_version(state):
+    return tuple(sorted(state["etags"].items()))
@@ -0,0 +1,179 @@
+# %%
+import json
+import time
+import logging
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+from temtemOneData import load_csv, load_partitioned_dataset
+from temtemOneStorage import get_backend
+from temtemOneCleaning import (
+    EXCLUSIONS,
+    ORDERS_RAW_COLUMNS,
+    LTV_COLUMNS,
+    USERS_COLUMNS,
+    clean_orders,
+    clean_ltv_data,
+    clean_users,
+)
+from temtemOneTiming import timed, timed_step, log_run
+
+logger = logging.getLogger(__name__)
+
+# Préfixe des datasets nettoyés ("gold") dans le bucket, lus par les tableaux de bord
+GOLD_PREFIX = "gold/"
+
+# Datasets publiés par l'ETL : fichier source, colonnes lues et fonction de nettoyage
+GOLD_DATASETS = {
+    "orders": {
+        "source": "csv_database/orders.csv",
+        "columns": ORDERS_RAW_COLUMNS,
+        "clean": clean_orders,
+    },
+    "ltv_data": {
+        "source": "csv_database/ltv_data.csv",
+        "columns": LTV_COLUMNS,
+        "clean": clean_ltv_data,
+    },
+    "users": {
+        "source": "csv_database/users_2023.csv",
+        "columns": USERS_COLUMNS,
+        "clean": clean_users,
+    },
+}
+
+
+def gold_file_name(name, gold_prefix=GOLD_PREFIX):
+    """
+    Renvoie la clé du fichier Parquet d'un dataset nettoyé.
+
+    Args:
+        name (str): Le nom du dataset (ex. "orders").
+        gold_prefix (str): Le préfixe des datasets nettoyés.
+
+    Returns:
+        str: La clé du fichier (ex. "gold/orders.parquet").
+    """
+    return f"{gold_prefix}{name}.parquet"
+
+
+def build_gold_dataset(backend, name, orders_layout="monolithic", orders_prefix=None):
+    """
+    Télécharge, parse et nettoie un dataset.
+
+    Args:
+        backend (StorageBackend): Le backend de stockage des fichiers sources.
+        name (str): Le nom du dataset (clé de `GOLD_DATASETS`).
+        orders_layout (str): "monolithic" ou "partitioned" (commandes mensuelles).
+        orders_prefix (str, optional): Le préfixe des partitions des commandes.
+
+    Returns:
+        pd.DataFrame: Le dataset nettoyé.
+    """
+    dataset = GOLD_DATASETS[name]
+    clean = timed_step(f"clean:{name}", dataset["clean"])
+    if name == "orders" and orders_layout == "partitioned":
+        return load_partitioned_dataset(
+            backend, orders_prefix, clean, dataset["columns"]
+        )
+    return clean(load_csv(backend, dataset["source"], dataset["columns"]))
+
+
+def publish_gold(
+    backend,
+    names=None,
+    gold_prefix=GOLD_PREFIX,
+    orders_layout="monolithic",
+    orders_prefix=None,
+):
+    """
+    Construit les datasets nettoyés et les publie en Parquet dans le stockage.
+
+    Chaque dataset est écrit dans un seul fichier (clé `gold_file_name`), puis un
+    manifeste `_manifest.json` décrit la publication (date, version du registre des
+    exclusions, nombre de lignes). Les tableaux de bord en mode "gold" ne font plus que
+    lire ces fichiers.
+
+    Args:
+        backend (StorageBackend): Le backend de stockage (sources et sorties).
+        names (list, optional): Les datasets à publier (tous si None).
+        gold_prefix (str): Le préfixe des datasets nettoyés.
+        orders_layout (str): "monolithic" ou "partitioned" (commandes mensuelles).
+        orders_prefix (str, optional): Le préfixe des partitions des commandes.
+
+    Returns:
+        dict: Le manifeste de la publication.
+    """
+    names = list(GOLD_DATASETS) if names is None else names
+    rows = {}
+    for name in names:
+        df = build_gold_dataset(backend, name, orders_layout, orders_prefix)
+        with timed(f"write:{name}", df):
+            sink = pa.BufferOutputStream()
+            pq.write_table(
+                pa.Table.from_pandas(df, preserve_index=False),
+                sink,
+                compression="zstd",
+            )
+            backend.write(gold_file_name(name, gold_prefix), sink.getvalue())
+        rows[name] = len(df)
+        logger.info("Dataset %s publié (%s lignes)", name, len(df))
+
+    manifest = {
+        "published_at": time.time(),
+        "exclusions_version": EXCLUSIONS["version"],
+        "rows": rows,
+    }
+    backend.write(
+        f"{gold_prefix}_manifest.json", json.dumps(manifest, indent=2).encode("utf-8")
+    )
+    return manifest
+
+
+def main(argv=None):
+    """
+    Point d'entrée en ligne de commande : `python -m temtemOneEtl [datasets...]`.
+
+    Args:
+        argv (list, optional): Les arguments (ceux de la ligne de commande si None).
+    """
+    parser = argparse.ArgumentParser(
+        description="Nettoie les datasets bruts et publie les datasets 'gold' en Parquet."
+    )
+    parser.add_argument(
+        "datasets",
+        nargs="*",
+        help=f"Datasets à publier parmi {', '.join(GOLD_DATASETS)} (tous par défaut).",
+    )
+    parser.add_argument(
+        "--mode",
+        default="boto3",
+        help="'production' (connexion Streamlit), 'local' (copie locale) ou 'boto3'.",
+    )
+    parser.add_argument("--bucket", default="one-data-lake")
+    parser.add_argument("--local-dir", default="one-data-lake")
+    parser.add_argument("--gold-prefix", default=GOLD_PREFIX)
+    parser.add_argument(
+        "--orders-layout", choices=["monolithic", "partitioned"], default="monolithic"
+    )
+    parser.add_argument("--orders-prefix", default="csv_database/orders/")
+    args = parser.parse_args(argv)
+    unknown = sorted(set(args.datasets) - set(GOLD_DATASETS))
+    if unknown:
+        parser.error(f"datasets inconnus : {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    started = time.perf_counter()
+    backend = get_backend(args.mode, args.bucket, args.local_dir)
+    publish_gold(
+        backend,
+        args.datasets or None,
+        gold_prefix=args.gold_prefix,
+        orders_layout=args.orders_layout,
+        orders_prefix=args.orders_prefix,
+    )
+    log_run("temtemOneEtl", started)
+
+
+if __name__ == "__main__":
+    main()
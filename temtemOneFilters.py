@@ -0,0 +1,143 @@
+# %%
+import numpy as np
+import pandas as pd
+
+
+class FilterIndex:
+    """
+    Index de filtrage d'un dataset : plage de dates et égalité sur des colonnes catégorielles.
+
+    L'index est construit une fois par version du dataset (dans le magasin) :
+      - les lignes sont ordonnées par date : une plage de dates est un intervalle de
+        positions, trouvé par `searchsorted` ;
+      - pour chaque colonne indexée, les positions (dans l'ordre des dates) de chaque
+        valeur sont précalculées : un filtre sur une valeur ne parcourt que les lignes
+        de cette valeur dans la plage de dates.
+
+    Le coût d'une requête suit donc la taille du résultat, et non celle du dataset. Les
+    requêtes renvoient des numéros de lignes ; le DataFrame d'origine n'est ni copié ni
+    modifié.
+
+    Args:
+        df (pd.DataFrame): Le dataset (traité en lecture seule).
+        columns (list): Les colonnes filtrées par égalité (ex. "customer_origine").
+        date_col (str): La colonne de dates.
+    """
+
+    def __init__(self, df, columns=(), date_col="date"):
+        self.df = df
+        self.date_col = date_col
+        # Dates en texte (ex. feuilles Google Sheets) : converties une seule fois ici
+        self._parse_dates = not pd.api.types.is_datetime64_dtype(df[date_col])
+        dates = pd.to_datetime(df[date_col]).to_numpy(dtype="datetime64[ns]")
+        if len(dates) and (np.diff(dates) >= np.timedelta64(0, "ns")).all():
+            # Dataset déjà trié par date : l'ordre des dates est l'ordre des lignes
+            self._order = None
+            self._dates = dates
+        else:
+            # Les dates manquantes (NaT) sont rangées à la fin et ne sont jamais retenues
+            self._order = np.argsort(dates, kind="stable")
+            self._dates = dates[self._order]
+
+        self._codes = {}
+        self._values = {}
+        self._groups = {}
+        for column in columns:
+            codes, uniques = pd.factorize(df[column], sort=False)
+            codes = codes if self._order is None else codes[self._order]
+            # Positions (dans l'ordre des dates) des lignes de chaque valeur, croissantes
+            by_code = np.argsort(codes, kind="stable")
+            bounds = np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques)))
+            start = np.count_nonzero(codes < 0)
+            self._groups[column] = np.split(by_code[start:], bounds[:-1])
+            self._codes[column] = codes
+            self._values[column] = {value: code for code, value in enumerate(uniques)}
+
+    def _date_range(self, start_date, end_date):
+        lo = 0
+        hi = len(self._dates)
+        if start_date is not None:
+            lo = np.searchsorted(
+                self._dates, np.datetime64(pd.Timestamp(start_date), "ns"), "left"
+            )
+        if end_date is not None:
+            hi = np.searchsorted(
+                self._dates, np.datetime64(pd.Timestamp(end_date), "ns"), "right"
+            )
+        return lo, max(lo, hi)
+
+    def rows(self, start_date=None, end_date=None, **equals):
+        """
+        Renvoie les numéros des lignes qui vérifient tous les filtres.
+
+        Args:
+            start_date (date, optional): La date de début (incluse).
+            end_date (date, optional): La date de fin (incluse).
+            **equals: Les filtres d'égalité {colonne indexée: valeur}.
+
+        Returns:
+            np.ndarray: Les positions des lignes dans le dataset, dans l'ordre du dataset.
+
+        Raises:
+            KeyError: Si une colonne filtrée n'est pas indexée.
+        """
+        lo, hi = self._date_range(start_date, end_date)
+        groups = []
+        for column, value in equals.items():
+            code = self._values[column].get(value)
+            if code is None:
+                return np.empty(0, dtype=np.intp)
+            group = self._groups[column][code]
+            # Lignes de cette valeur dans la plage de dates
+            group = group[np.searchsorted(group, lo) : np.searchsorted(group, hi)]
+            groups.append((len(group), column, code, group))
+
+        if not groups:
+            positions = np.arange(lo, hi)
+        else:
+            # Les autres filtres ne sont vérifiés que sur les lignes du plus petit groupe
+            groups.sort(key=lambda entry: entry[0])
+            positions = groups[0][3]
+            for _, column, code, _ in groups[1:]:
+                positions = positions[self._codes[column][positions] == code]
+
+        if self._order is None:
+            return positions
+        return np.sort(self._order[positions])
+
+    def select(self, start_date=None, end_date=None, **equals):
+        """
+        Renvoie les lignes qui vérifient tous les filtres.
+
+        Seules les lignes retenues sont copiées : le résultat peut être modifié sans
+        toucher au dataset partagé. Sa colonne de dates est toujours en datetime64.
+
+        Args:
+            start_date (date, optional): La date de début (incluse).
+            end_date (date, optional): La date de fin (incluse).
+            **equals: Les filtres d'égalité {colonne indexée: valeur}.
+
+        Returns:
+            pd.DataFrame: Les lignes retenues, dans l'ordre du dataset.
+        """
+        selected = self.df.take(self.rows(start_date, end_date, **equals))
+        if self._parse_dates:
+            selected[self.date_col] = pd.to_datetime(selected[self.date_col])
+        return selected
+
+
+def equality_filters(**selections):
+    """
+    Convertit les choix des listes déroulantes en filtres d'égalité ("Tous" ou "Toutes" : pas de filtre).
+
+    Args:
+        **selections: Les valeurs choisies {colonne: valeur}.
+
+    Returns:
+        dict: Les filtres à appliquer {colonne: valeur}.
+    """
+    return {
+        column: value
+        for column, value in selections.items()
+        if value not in ("Tous", "Toutes")
+    }
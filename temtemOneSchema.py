@@ -0,0 +1,198 @@
+# %%
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+# Types déclarés par dataset, appliqués dès le parsing des CSV (noms de colonnes bruts).
+#   "category"  : colonne catégorielle (dictionnaire Arrow -> pd.Categorical)
+#   "string"    : identifiant stocké en chaîne compacte (string[pyarrow])
+#   "id"        : identifiant numérique stocké en entier nullable (Int64), sans le
+#                 suffixe ".0" des exports
+#   "timestamp" : date parsée en datetime64[ns] (sans fuseau horaire)
+SCHEMAS = {
+    "orders": {
+        "order_id": "string",
+        "customer_id": "id",
+        "date": "timestamp",
+        "previous_order_date": "timestamp",
+        "job_status": "category",
+        "businessCat": "category",
+        "customer_origine": "category",
+        "paymentType": "category",
+        "Order Type": "category",
+    },
+    "ltv_data": {
+        "order_id": "string",
+        "customer_id": "id",
+        "date": "timestamp",
+        "job_status": "category",
+        "businessCat": "category",
+        "customer_origine": "category",
+        "paymentType": "category",
+    },
+    "users_2023": {
+        "customer_id": "id",
+        "date": "timestamp",
+        "Origine": "category",
+        "customer_country": "category",
+    },
+}
+
+# Correspondance entre les types déclarés et les types Arrow utilisés par le parseur CSV
+ARROW_TYPES = {
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "string": pa.string(),
+    # Lu en chaîne puis converti par `parse_ids` (les exports écrivent parfois "123.0")
+    "id": pa.string(),
+    "timestamp": pa.timestamp("ns"),
+}
+
+
+def arrow_column_types(schema):
+    """
+    Convertit un schéma déclaré en types de colonnes pour le lecteur CSV Arrow.
+
+    Args:
+        schema (dict): Le schéma {colonne: type déclaré}.
+
+    Returns:
+        dict: Un dictionnaire {colonne: pa.DataType}.
+    """
+    return {column: ARROW_TYPES[kind] for column, kind in schema.items()}
+
+
+def schema_fingerprint(schema, columns=None):
+    """
+    Calcule une empreinte courte du schéma et des colonnes lues, utilisée pour invalider les snapshots locaux.
+
+    Args:
+        schema (dict): Le schéma {colonne: type déclaré}.
+        columns (list, optional): Les colonnes lues (toutes si None).
+
+    Returns:
+        str: Les 8 premiers caractères de l'empreinte SHA-1.
+    """
+    projection = sorted(columns) if columns is not None else None
+    payload = json.dumps([schema, projection], sort_keys=True).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:8]
+
+
+def parse_ids(values, index=None, name=None):
+    """
+    Convertit une colonne d'identifiants numériques en entiers nullables (Int64), de façon vectorisée.
+
+    Les artefacts des exports (suffixe ".0" des identifiants passés par un float,
+    espaces) sont supprimés. Les valeurs qui ne sont pas des entiers deviennent
+    manquantes et sont signalées dans le journal.
+
+    Args:
+        values (pa.Array | pa.ChunkedArray | pd.Series): Les identifiants bruts.
+        index (pd.Index, optional): L'index de la colonne renvoyée.
+        name (str, optional): Le nom de la colonne renvoyée.
+
+    Returns:
+        pd.Series: Les identifiants en Int64.
+    """
+    if isinstance(values, pd.Series):
+        if pd.api.types.is_integer_dtype(values.dtype) or pd.api.types.is_float_dtype(
+            values.dtype
+        ):
+            return values.astype("Int64")
+        index = values.index if index is None else index
+        name = values.name if name is None else name
+        values = pa.array(values.astype(object), type=pa.string(), from_pandas=True)
+
+    values = pc.replace_substring_regex(pc.utf8_trim_whitespace(values), r"\.0$", "")
+    valid = pc.match_substring_regex(values, r"^-?[0-9]+$")
+    invalid = pc.sum(pc.invert(valid)).as_py() or 0
+    if invalid:
+        logger.warning(
+            "%s identifiants non numériques ignorés dans la colonne %s", invalid, name
+        )
+        values = pc.if_else(valid, values, pa.scalar(None, pa.string()))
+    ids = pc.cast(values, pa.int64()).to_pandas(
+        types_mapper={pa.int64(): pd.Int64Dtype()}.get
+    )
+    if index is not None:
+        ids.index = index
+    ids.name = name
+    return ids
+
+
+def apply_schema(df, schema, table=None):
+    """
+    Applique le schéma déclaré aux colonnes d'un DataFrame.
+
+    Les colonnes déjà au bon type (parsées par Arrow) ne sont pas converties à nouveau.
+    Les identifiants sont repris sans copie depuis la table Arrow quand elle est fournie.
+
+    Args:
+        df (pd.DataFrame): Le DataFrame parsé.
+        schema (dict): Le schéma {colonne: type déclaré}.
+        table (pa.Table, optional): La table Arrow dont provient le DataFrame.
+
+    Returns:
+        pd.DataFrame: Le DataFrame typé.
+    """
+    for column, kind in schema.items():
+        if column not in df.columns:
+            continue
+        if kind == "category" and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+        elif kind == "timestamp" and not pd.api.types.is_datetime64_dtype(df[column]):
+            # Dates naïves, à l'heure locale indiquée dans le fichier
+            timestamps = pd.to_datetime(df[column])
+            if timestamps.dt.tz is not None:
+                timestamps = timestamps.dt.tz_localize(None)
+            df[column] = timestamps
+        elif kind == "id" and df[column].dtype != "Int64":
+            if table is not None:
+                df[column] = parse_ids(
+                    table.column(column), index=df.index, name=column
+                )
+            else:
+                df[column] = parse_ids(df[column])
+        elif kind == "string" and df[column].dtype != "string[pyarrow]":
+            if table is not None and table.schema.field(column).type == pa.string():
+                df[column] = pd.arrays.ArrowStringArray(table.column(column))
+            else:
+                df[column] = df[column].astype("string[pyarrow]")
+    return df
+
+
+def replace_categories(series, mapping):
+    """
+    Remplace des valeurs d'une colonne catégorielle en travaillant sur les catégories et les codes.
+
+    Plusieurs anciennes catégories peuvent être fusionnées dans une même valeur (ex.
+    "Recharge mobile" et "Recharge mobile / ADSL" -> "Airtime") sans repasser par des
+    chaînes Python ligne par ligne.
+
+    Args:
+        series (pd.Series): La colonne à transformer.
+        mapping (dict): Un dictionnaire {ancienne valeur: nouvelle valeur}.
+
+    Returns:
+        pd.Series: La colonne transformée, toujours catégorielle.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.replace(mapping)
+    if len(series.cat.categories) == 0:
+        return series
+
+    target = pd.Index([mapping.get(value, value) for value in series.cat.categories])
+    new_categories = target.unique()
+    recode = new_categories.get_indexer(target)
+    codes = series.cat.codes.to_numpy()
+    new_codes = np.where(codes >= 0, recode[codes], -1)
+    return pd.Series(
+        pd.Categorical.from_codes(new_codes, new_categories),
+        index=series.index,
+        name=series.name,
+    )
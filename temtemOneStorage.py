@@ -0,0 +1,426 @@
+# %%
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from st_files_connection import FilesConnection
+import streamlit as st
+import toml
+from temtemOneTiming import timed
+
+# Téléchargement par plages : taille d'une plage et nombre de plages téléchargées en parallèle
+RANGE_SIZE = 8 << 20
+RANGE_WORKERS = 8
+
+# Taille du pool de connexions HTTP du client S3 partagé
+S3_MAX_POOL_CONNECTIONS = 32
+
+
+# %%
+# Fonction pour charger les secrets depuis le fichier secrets.toml
+def load_secrets():
+    """
+    Charge les secrets depuis le fichier 'secrets.toml'.
+
+    Returns:
+        dict: Un dictionnaire contenant les secrets chargés.
+    """
+    # Obtenez le chemin complet vers le fichier secrets.toml
+    secrets_file_path = os.path.join(".streamlit", "secrets.toml")
+
+    # Chargez le fichier secrets.toml
+    secrets = toml.load(secrets_file_path)
+
+    return secrets
+
+
+# %%
+# Clients S3 partagés par le processus : (clé d'accès, clé secrète) -> client boto3
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def get_s3_client(secrets):
+    """
+    Renvoie le client S3 partagé pour ces identifiants, en le créant au premier appel.
+
+    Les clients boto3 sont utilisables depuis plusieurs threads : un seul client (et son
+    pool de connexions HTTP) sert tous les téléchargements, au lieu de refaire la
+    session et la négociation TLS à chaque fichier.
+
+    Args:
+        secrets (dict): Un dictionnaire contenant les informations d'identification AWS.
+
+    Returns:
+        botocore.client.S3: Le client S3.
+    """
+    credentials = (
+        secrets["s3_credentials"]["AWS_ACCESS_KEY_ID"],
+        secrets["s3_credentials"]["AWS_SECRET_ACCESS_KEY"],
+    )
+    with _s3_clients_lock:
+        if credentials not in _s3_clients:
+            _s3_clients[credentials] = boto3.client(
+                "s3",
+                aws_access_key_id=credentials[0],
+                aws_secret_access_key=credentials[1],
+                config=Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 5, "mode": "adaptive"},
+                ),
+            )
+        return _s3_clients[credentials]
+
+
+def get_object_ranged(s3_client, request):
+    """
+    Télécharge un objet S3 par plages d'octets récupérées en parallèle.
+
+    La première plage est demandée avec la requête d'origine (donc avec son éventuel
+    If-None-Match) et donne la taille de l'objet ; les plages suivantes sont
+    téléchargées en parallèle avec If-Match sur l'ETag de la première, puis
+    réassemblées dans un seul tampon. Sur un lien à forte latence, le débit n'est plus
+    limité par un unique flux GET.
+
+    Args:
+        s3_client (botocore.client.S3): Le client S3.
+        request (dict): Les paramètres de get_object (Bucket, Key, IfNoneMatch...).
+
+    Returns:
+        dict: La réponse de la première plage, avec "Body" (flux de l'objet complet) et
+            "reopen" (fonction qui rouvre un flux sur l'objet complet).
+
+    Raises:
+        botocore.exceptions.ClientError: En particulier 304 si l'objet n'a pas changé.
+    """
+    try:
+        first = s3_client.get_object(Range=f"bytes=0-{RANGE_SIZE - 1}", **request)
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] != "InvalidRange":
+            raise
+        # Objet vide : aucune plage ne peut être demandée
+        response = s3_client.get_object(**request)
+        content = response["Body"].read()
+        return {
+            **response,
+            "Body": pa.BufferReader(content),
+            "reopen": lambda: pa.BufferReader(content),
+        }
+
+    size = int(first["ContentRange"].rsplit("/", 1)[1])
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+
+    def fetch(start):
+        end = min(start + RANGE_SIZE, size)
+        if start == 0:
+            body = first["Body"]
+        else:
+            body = s3_client.get_object(
+                Bucket=request["Bucket"],
+                Key=request["Key"],
+                Range=f"bytes={start}-{end - 1}",
+                IfMatch=first["ETag"],
+            )["Body"]
+        view[start:end] = body.read()
+
+    starts = range(0, size, RANGE_SIZE)
+    if len(starts) == 1:
+        fetch(0)
+    else:
+        with ThreadPoolExecutor(
+            max_workers=min(len(starts), RANGE_WORKERS)
+        ) as executor:
+            list(executor.map(fetch, starts))
+
+    content = pa.py_buffer(buffer)
+    return {
+        **first,
+        "Body": pa.BufferReader(content),
+        "reopen": lambda: pa.BufferReader(content),
+    }
+
+
+# %%
+class StorageBackend:
+    """
+    Interface d'accès aux fichiers du data lake (S3, connexion Streamlit ou copie locale).
+
+    Les chargeurs de `temtemOneData` ne dépendent que de cette interface : la même
+    chaîne de chargement (revalidation par ETag, snapshots, parsing Arrow) tourne sur
+    le bucket ou sur une copie locale de `one-data-lake`.
+
+    Attributes:
+        name (str): L'identifiant de l'emplacement (nom du bucket, répertoire local),
+            utilisé dans les clés des caches en mémoire.
+    """
+
+    name = None
+
+    def fetch(self, file_name, etag=None):
+        """
+        Ouvre un fichier, sauf s'il n'a pas changé depuis la version `etag`.
+
+        Args:
+            file_name (str): La clé du fichier (ex. "csv_database/orders.csv").
+            etag (str, optional): L'ETag de la version déjà connue.
+
+        Returns:
+            dict | None: None si le fichier a toujours l'ETag `etag`, sinon un dictionnaire
+                avec "ETag", "Body" (flux binaire), "reopen" (fonction qui rouvre un flux
+                sur le même contenu) et éventuellement "ContentEncoding".
+        """
+        raise NotImplementedError
+
+    def etag(self, file_name):
+        """
+        Renvoie l'ETag actuel d'un fichier, sans le télécharger (requête HEAD sur S3).
+
+        Args:
+            file_name (str): La clé du fichier.
+
+        Returns:
+            str: L'ETag du fichier.
+        """
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """
+        Liste les fichiers sous un préfixe avec leur ETag.
+
+        Args:
+            prefix (str): Le préfixe (ex. "csv_database/orders/").
+
+        Returns:
+            dict: Un dictionnaire {clé du fichier: ETag}.
+        """
+        raise NotImplementedError
+
+    def read_json(self, file_name):
+        """
+        Lit un fichier JSON (ex. la clé Google).
+
+        Args:
+            file_name (str): La clé du fichier.
+
+        Returns:
+            dict: L'objet JSON.
+        """
+        raise NotImplementedError
+
+    def write(self, file_name, data):
+        """
+        Écrit (ou remplace) un fichier, par exemple un dataset publié par l'ETL.
+
+        Args:
+            file_name (str): La clé du fichier.
+            data (bytes | pa.Buffer): Le contenu du fichier.
+        """
+        raise NotImplementedError
+
+
+class S3Backend(StorageBackend):
+    """
+    Bucket S3 lu avec boto3 et les identifiants du fichier secrets.toml.
+
+    Args:
+        secrets (dict): Un dictionnaire contenant les informations d'identification AWS.
+        bucket_name (str): Le nom du bucket S3.
+    """
+
+    def __init__(self, secrets, bucket_name):
+        self.name = bucket_name
+        self._client = get_s3_client(secrets)
+
+    def fetch(self, file_name, etag=None):
+        request = {"Bucket": self.name, "Key": file_name}
+        if etag is not None:
+            request["IfNoneMatch"] = etag
+        try:
+            return get_object_ranged(self._client, request)
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] not in ("304", "NotModified"):
+                raise
+            return None
+
+    def etag(self, file_name):
+        return self._client.head_object(Bucket=self.name, Key=file_name)["ETag"]
+
+    def list(self, prefix):
+        paginator = self._client.get_paginator("list_objects_v2")
+        return {
+            entry["Key"]: entry["ETag"]
+            for page in paginator.paginate(Bucket=self.name, Prefix=prefix)
+            for entry in page.get("Contents", [])
+        }
+
+    def read_json(self, file_name):
+        response = self._client.get_object(Bucket=self.name, Key=file_name)
+        object_content = response["Body"].read().decode("utf-8")
+
+        # Utilisez la bibliothèque json pour charger le contenu en tant qu'objet JSON
+        return json.loads(object_content)
+
+    def write(self, file_name, data):
+        self._client.put_object(Bucket=self.name, Key=file_name, Body=bytes(data))
+
+
+class ConnectionBackend(StorageBackend):
+    """
+    Bucket S3 lu avec la connexion expérimentale Streamlit (FilesConnection).
+
+    Le système de fichiers de la connexion ne propose pas de GET conditionnel : la
+    revalidation se fait par une requête HEAD qui compare l'ETag à la version connue.
+
+    Args:
+        bucket_name (str): Le nom du bucket S3.
+    """
+
+    def __init__(self, bucket_name):
+        self.name = bucket_name
+        # Créer la connexion dans le thread appelant : les threads de chargement la
+        # retrouvent ensuite dans le cache de ressources de Streamlit
+        self._conn = st.experimental_connection("s3", type=FilesConnection)
+
+    def _head(self, file_name):
+        # Requête HEAD directe (s3fs) : `fs.info` ne donne pas le Content-Encoding
+        return self._conn.fs.call_s3("head_object", Bucket=self.name, Key=file_name)
+
+    def fetch(self, file_name, etag=None):
+        path = f"{self.name}/{file_name}"
+        head = self._head(file_name)
+        if etag is not None and head["ETag"] == etag:
+            return None
+        size = head["ContentLength"]
+        if size > RANGE_SIZE:
+            # Gros objet : plages d'octets téléchargées en parallèle, chacune copiée dans
+            # un tampon unique dès sa réception (comme `get_object_ranged`)
+            data = bytearray(size)
+            view = memoryview(data)
+
+            def fetch(start):
+                end = min(start + RANGE_SIZE, size)
+                view[start:end] = self._conn.fs.cat_file(path, start, end)
+
+            with ThreadPoolExecutor(
+                max_workers=min(-(-size // RANGE_SIZE), RANGE_WORKERS)
+            ) as executor:
+                list(executor.map(fetch, range(0, size, RANGE_SIZE)))
+        else:
+            data = self._conn.fs.cat_file(path)
+        content = pa.py_buffer(data)
+        return {
+            "ETag": head["ETag"],
+            "ContentEncoding": head.get("ContentEncoding"),
+            "Body": pa.BufferReader(content),
+            "reopen": lambda: pa.BufferReader(content),
+        }
+
+    def etag(self, file_name):
+        return self._head(file_name)["ETag"]
+
+    def list(self, prefix):
+        return {
+            entry["name"].split("/", 1)[1]: entry["ETag"]
+            for entry in self._conn.fs.ls(
+                f"{self.name}/{prefix}", detail=True, refresh=True
+            )
+            if entry["type"] == "file"
+        }
+
+    def read_json(self, file_name):
+        return self._conn.read(
+            f"{self.name}/{file_name}",
+            input_format="json",  # Modifier le format d'entrée en 'json'
+            ttl=600,
+        )
+
+    def write(self, file_name, data):
+        self._conn.fs.pipe_file(f"{self.name}/{file_name}", bytes(data))
+
+
+class LocalBackend(StorageBackend):
+    """
+    Copie locale du data lake (même arborescence que le bucket), pour le profilage et les tests de charge.
+
+    L'ETag d'un fichier local est dérivé de sa date de modification et de sa taille :
+    la revalidation et les snapshots fonctionnent comme sur S3, sans aucun accès réseau.
+
+    Args:
+        root (str): Le répertoire racine de la copie (ex. "one-data-lake").
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.name = f"file://{os.path.abspath(root)}"
+
+    def _path(self, file_name):
+        return os.path.join(self.root, *file_name.split("/"))
+
+    @staticmethod
+    def _etag(stat):
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def fetch(self, file_name, etag=None):
+        path = self._path(file_name)
+        current = self._etag(os.stat(path))
+        if etag is not None and current == etag:
+            return None
+        return {
+            "ETag": current,
+            "Body": pa.memory_map(path, "r"),
+            "reopen": lambda: pa.memory_map(path, "r"),
+        }
+
+    def etag(self, file_name):
+        return self._etag(os.stat(self._path(file_name)))
+
+    def list(self, prefix):
+        directory, _, name_prefix = prefix.rpartition("/")
+        base = self._path(directory) if directory else self.root
+        etags = {}
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    etags[key] = self._etag(os.stat(path))
+        return etags
+
+    def read_json(self, file_name):
+        with open(self._path(file_name), encoding="utf-8") as f:
+            return json.load(f)
+
+    def write(self, file_name, data):
+        path = self._path(file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Fichier temporaire renommé atomiquement : un lecteur ne voit jamais un fichier partiel
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+def get_backend(mode, bucket_name, local_dir=None):
+    """
+    Crée le backend de stockage correspondant au mode de fonctionnement.
+
+    Args:
+        mode (str): "production" pour la connexion Streamlit, "local" pour une copie
+            locale du bucket, sinon boto3 avec les secrets toml.
+        bucket_name (str): Le nom du bucket S3.
+        local_dir (str, optional): Le répertoire de la copie locale (mode "local").
+
+    Returns:
+        StorageBackend: Le backend de stockage.
+    """
+    if mode == "production":
+        return ConnectionBackend(bucket_name)
+    if mode == "local":
+        return LocalBackend(local_dir or bucket_name)
+    with timed("secrets"):
+        secrets = load_secrets()
+    return S3Backend(secrets, bucket_name)
@@ -0,0 +1,522 @@
+# %%
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+from temtemOneData import recording_sources
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou entre processus
+    fcntl = None
+
+# Mémoire maximale occupée par les résultats gardés par `DatasetStore.cached`
+MAX_RESULT_BYTES = 256 << 20
+
+
+def _arrow_strings(arrow_type):
+    # Chaînes Arrow lues en string[pyarrow] (sans copie) plutôt qu'en objets Python
+    if arrow_type == pa.string():
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+class SharedFrames:
+    """
+    Répertoire de DataFrames nettoyés publiés en Arrow IPC et mappés en mémoire par tous les processus.
+
+    Quand plusieurs processus Streamlit tournent sur la même machine, le premier qui
+    construit un dataset l'écrit dans un fichier Arrow IPC (non compressé) ; les autres
+    processus le mappent en mémoire en lecture seule au lieu de le recharger. Les pages
+    du fichier sont partagées par le cache du système : la mémoire utilisée est proche
+    d'une seule copie par machine, et un nouveau processus s'attache presque
+    instantanément. Un répertoire en mémoire (ex. /dev/shm/temtem) évite aussi les
+    écritures disque.
+
+    Les chaînes sont lues en string[pyarrow] : comme les colonnes numériques sans
+    valeur manquante et les dates, elles restent adossées au fichier mappé, sans
+    copie. Les catégories et les entiers avec valeurs manquantes (Int64) sont
+    convertis à l'attache.
+
+    Args:
+        directory (str): Le répertoire partagé par les processus.
+        max_age (float): L'âge maximal (en secondes) d'un fichier publié pour qu'un
+            processus qui démarre s'y attache au lieu de reconstruire le dataset.
+    """
+
+    def __init__(self, directory, max_age):
+        self.directory = directory
+        self.max_age = max_age
+        self._attached = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _manifest_path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    @contextmanager
+    def lock(self, name):
+        """
+        Verrou exclusif entre processus sur un dataset, pour qu'un seul processus le construise.
+
+        Args:
+            name (str): Le nom du dataset.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, f"{name}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def attach(self, name, published_after):
+        """
+        Mappe en mémoire la dernière version publiée d'un dataset, si elle est assez récente.
+
+        Args:
+            name (str): Le nom du dataset.
+            published_after (float): L'horodatage minimal de publication accepté.
+
+        Returns:
+            pd.DataFrame | None: Le DataFrame en lecture seule, ou None si aucune version
+                assez récente n'est publiée.
+        """
+        try:
+            with open(self._manifest_path(name), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest["published_at"] < published_after:
+            return None
+
+        path = os.path.join(self.directory, manifest["file"])
+        attached = self._attached.get(name)
+        if attached is None or attached[0] != path:
+            try:
+                source = pa.memory_map(path, "r")
+            except OSError:
+                # Fichier remplacé entre la lecture du manifeste et l'ouverture
+                return None
+            table = pa.ipc.open_file(source).read_all()
+            # Une seule version attachée par dataset dans ce processus : l'ancienne est
+            # libérée quand plus aucune session ne la lit
+            attached = (
+                path,
+                table.to_pandas(split_blocks=True, types_mapper=_arrow_strings),
+            )
+            self._attached[name] = attached
+        return attached[1]
+
+    def publish(self, name, df):
+        """
+        Écrit un dataset en Arrow IPC, le publie pour les autres processus et s'y attache.
+
+        Args:
+            name (str): Le nom du dataset.
+            df (pd.DataFrame): Le DataFrame nettoyé.
+
+        Returns:
+            pd.DataFrame: Le DataFrame mappé en mémoire qui remplace `df`.
+        """
+        published_at = time.time()
+        file_name = f"{name}-{time.time_ns()}.arrow"
+        path = os.path.join(self.directory, file_name)
+        table = pa.Table.from_pandas(df)
+        with pa.OSFile(f"{path}.tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(f"{path}.tmp", path)
+
+        manifest_path = self._manifest_path(name)
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"file": file_name, "published_at": published_at}, f)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+        # Les anciennes versions restent lisibles par les processus qui les ont déjà
+        # mappées (sous Linux, la suppression ne libère le fichier qu'au dernier unmap)
+        for old in os.listdir(self.directory):
+            if (
+                old.startswith(f"{name}-")
+                and old.endswith(".arrow")
+                and old != file_name
+            ):
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass
+        return self.attach(name, published_at)
+
+
+def _result_size(value):
+    # Taille d'un résultat, sans parcourir les valeurs (les chaînes Python ne sont
+    # comptées que par leur pointeur)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=False))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(map(_result_size, value.values()))
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    Cache borné (LRU) des résultats calculés sur les datasets : filtres, cohortes, LTV.
+
+    Les clés sont courtes (nom et version du dataset, fonction, paramètres) : aucun
+    DataFrame n'est haché pour retrouver un résultat. Le cache est borné par la
+    mémoire occupée par les résultats (`memory_usage` des DataFrames) : quand elle
+    dépasse la limite, les résultats utilisés le moins récemment sont retirés. Un
+    résultat plus gros que la limite est renvoyé sans être gardé.
+
+    Args:
+        max_bytes (int): La mémoire maximale (en octets) occupée par les résultats.
+    """
+
+    def __init__(self, max_bytes=MAX_RESULT_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """
+        Renvoie le résultat associé à une clé, en le calculant s'il est absent.
+
+        Args:
+            key (tuple): La clé du résultat (hachable).
+            compute (callable): La fonction sans argument qui calcule le résultat.
+
+        Returns:
+            Le résultat (partagé : à traiter en lecture seule).
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        # Calcul hors du verrou : les autres sessions ne l'attendent pas
+        value = compute()
+        size = _result_size(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries[key][1]
+            self._entries[key] = (value, size)
+            self._entries.move_to_end(key)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+        return value
+
+    def clear(self):
+        """
+        Vide le cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Staging:
+    # Version en cours de construction : les dépendances d'un dataset rechargé sont
+    # lues dans la nouvelle version, pas dans celle que les pages lisent encore
+    def __init__(self, store):
+        self._store = store
+        self.datasets = {}
+
+    def __getitem__(self, name):
+        if name in self.datasets:
+            return self.datasets[name]
+        return self._store.get(name)
+
+
+class _Reader:
+    # Vue transmise à une fonction de chargement : retient les datasets qu'elle lit
+    def __init__(self, view):
+        self._view = view
+        self.names = []
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return self._view[name]
+
+
+def _same_value(left, right):
+    # Compare deux versions d'un dataset (DataFrame, dictionnaire de DataFrames, JSON)
+    if isinstance(left, (pd.DataFrame, pd.Series)):
+        return type(left) is type(right) and left.equals(right)
+    if isinstance(left, dict):
+        return (
+            isinstance(right, dict)
+            and left.keys() == right.keys()
+            and all(_same_value(left[key], right[key]) for key in left)
+        )
+    return left == right
+
+
+class DatasetStore:
+    """
+    Magasin des datasets nettoyés, partagé par toutes les sessions et tous les reruns du processus.
+
+    Le magasin est créé une seule fois par processus (via `st.cache_resource` dans les
+    applications). Chaque dataset est chargé et nettoyé à son premier accès, depuis la
+    page qui en a besoin : une page n'attend que les données qu'elle affiche, et chaque
+    session lit les mêmes DataFrames au lieu d'en garder sa propre copie.
+
+    Les DataFrames renvoyés sont partagés : ils doivent être traités en lecture seule
+    (les fonctions de filtrage travaillent sur des copies).
+
+    Le magasin retient les fichiers (avec leur ETag) et les autres datasets lus par
+    chaque chargement : un rafraîchissement ne reconstruit que les datasets dont une
+    entrée a changé.
+
+    Args:
+        loaders (dict): Un dictionnaire {nom du dataset: fonction de chargement}. Chaque
+            fonction reçoit le magasin (pour lire les datasets dont elle dépend) et renvoie
+            le dataset nettoyé.
+        shared (SharedFrames, optional): Le répertoire partagé avec les autres processus
+            de la machine. Sans répertoire partagé, chaque processus garde ses propres
+            DataFrames.
+        max_result_bytes (int): La mémoire maximale (en octets) des résultats gardés
+            par `cached`.
+        volatile (tuple): Les datasets lus hors du stockage (ex. Google Sheets), sans
+            ETag : ils sont reconstruits à chaque rafraîchissement et comparés à la
+            version courante.
+    """
+
+    def __init__(
+        self, loaders, shared=None, max_result_bytes=MAX_RESULT_BYTES, volatile=()
+    ):
+        self._loaders = loaders
+        self._shared = shared
+        self._volatile = set(volatile)
+        self._locks = {name: threading.Lock() for name in loaders}
+        self._refresh_lock = threading.Lock()
+        self._datasets = {}
+        self._sources = {}
+        self._deps = {}
+        self._refresher = None
+        self.loaded_at = {}
+        self.version = 0
+        self.refreshed_at = time.time()
+        self.results = ResultCache(max_result_bytes)
+
+    def get(self, name):
+        """
+        Renvoie un dataset, en le chargeant au premier accès.
+
+        Un seul thread charge un dataset donné : les sessions qui le demandent en même
+        temps attendent ce chargement au lieu de le refaire.
+
+        Args:
+            name (str): Le nom du dataset.
+
+        Returns:
+            pd.DataFrame | dict: Le dataset nettoyé.
+
+        Raises:
+            KeyError: Si aucun chargement n'est déclaré pour ce nom.
+        """
+        if name in self._datasets:
+            return self._datasets[name]
+        with self._locks[name]:
+            if name not in self._datasets:
+                value, self._sources[name], self._deps[name] = self._build(name, self)
+                self._datasets[name] = value
+                self.loaded_at[name] = time.time()
+            return self._datasets[name]
+
+    def _build(self, name, view, published_after=None):
+        # Construit un dataset en retenant les fichiers et les datasets qu'il lit
+        reader = _Reader(view)
+        with recording_sources() as sources:
+            value = self._produce(name, reader, published_after)
+        return value, sources, reader.names
+
+    def _produce(self, name, store, published_after=None):
+        # Sans répertoire partagé, ou pour les objets qui ne sont pas des DataFrames,
+        # le dataset est simplement chargé dans ce processus
+        if self._shared is None:
+            return self._loaders[name](store)
+        if published_after is None:
+            published_after = time.time() - self._shared.max_age
+        with self._shared.lock(name):
+            df = self._shared.attach(name, published_after)
+            if df is not None:
+                return df
+            value = self._loaders[name](store)
+            if isinstance(value, pd.DataFrame):
+                return self._shared.publish(name, value)
+            return value
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def is_loaded(self, name):
+        """
+        Indique si un dataset est déjà en mémoire.
+
+        Args:
+            name (str): Le nom du dataset.
+
+        Returns:
+            bool: True si le dataset a déjà été chargé.
+        """
+        return name in self._datasets
+
+    def cached(self, name, func, *params):
+        """
+        Calcule `func(dataset, *params)` une seule fois par version des données et par paramètres.
+
+        La clé du résultat est la version des données (`version`, incrémentée à chaque
+        rafraîchissement), le nom du dataset, la fonction et ses paramètres : retrouver
+        un résultat ne coûte qu'un hachage de quelques valeurs, quelle que soit la
+        taille du dataset.
+
+        Args:
+            name (str): Le nom du dataset (ou de son index) passé en premier argument.
+            func (callable): La fonction de calcul (ex. `apply_filters`).
+            *params: Les autres arguments de la fonction (hachables : chaînes, dates).
+
+        Returns:
+            Le résultat de la fonction, partagé par toutes les sessions : il doit être
+            traité en lecture seule (l'appelant qui le modifie travaille sur une copie).
+        """
+        # La version est lue avant le dataset : un résultat calculé pendant un
+        # rafraîchissement est rangé sous l'ancienne version et ne sera plus servi
+        version = self.version
+        key = (name, version, func.__module__, func.__qualname__, params)
+        return self.results.get(key, lambda: func(self.get(name), *params))
+
+    def preload(self, names):
+        """
+        Charge en parallèle plusieurs datasets indépendants dont une page a besoin.
+
+        Args:
+            names (list): Les noms des datasets à charger.
+        """
+        missing = [name for name in names if not self.is_loaded(name)]
+        if len(missing) <= 1:
+            for name in missing:
+                self.get(name)
+            return
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            list(executor.map(self.get, missing))
+
+    def age(self):
+        """
+        Renvoie l'âge de la version courante des données.
+
+        Returns:
+            float: Le nombre de secondes écoulées depuis le dernier rafraîchissement réussi.
+        """
+        return time.time() - self.refreshed_at
+
+    def refresh(self):
+        """
+        Revalide les datasets déjà en mémoire et remplace d'un seul coup ceux qui ont changé.
+
+        Chaque fichier lu par un dataset est revalidé immédiatement (sans délai de
+        revalidation). Seuls les datasets dont un fichier ou une dépendance a changé
+        sont reconstruits ; les datasets dont aucune entrée n'est connue (volatiles ou
+        repris d'un autre processus) sont reconstruits et gardés s'ils sont identiques.
+        Si rien n'a changé, la version et les résultats en cache sont conservés.
+
+        La nouvelle version est construite à côté de la version courante : les lecteurs
+        continuent d'obtenir l'ancienne version pendant le rechargement, puis la
+        nouvelle remplace l'ancienne en une seule affectation. Si un chargement échoue,
+        la version courante est conservée.
+        """
+        with self._refresh_lock:
+            staging = _Staging(self)
+            built = {}
+            # Les dépendances d'un dataset sont chargées avant lui : elles sont déjà
+            # revalidées quand il est examiné
+            for name in list(self._datasets):
+                sources = self._sources.get(name, [])
+                deps = self._deps.get(name, [])
+                # Toutes les sources sont revalidées (pas d'arrêt au premier
+                # changement) : la reconstruction lit alors les dernières versions
+                changed = [source.changed() for source in sources]
+                untracked = name in self._volatile or not (sources or deps)
+                if not (
+                    untracked
+                    or any(changed)
+                    or any(dep in staging.datasets for dep in deps)
+                ):
+                    continue
+                # Avec un répertoire partagé, une version publiée par un autre
+                # processus après celle que nous lisons est reprise
+                value, sources, deps = self._build(
+                    name, staging, self.loaded_at.get(name, 0)
+                )
+                if untracked and _same_value(value, self._datasets[name]):
+                    if name not in self._volatile:
+                        # Dataset repris d'un autre processus : ses entrées sont
+                        # désormais connues
+                        self._sources[name], self._deps[name] = sources, deps
+                    continue
+                staging.datasets[name] = value
+                built[name] = (sources, deps)
+
+            refreshed_at = time.time()
+            fresh = staging.datasets
+            if fresh:
+                # Les datasets chargés à la demande pendant le rechargement sont conservés
+                self._datasets = {**self._datasets, **fresh}
+                self.loaded_at.update(dict.fromkeys(fresh, refreshed_at))
+                for name, (sources, deps) in built.items():
+                    self._sources[name] = sources
+                    self._deps[name] = deps
+                self.version += 1
+            self.refreshed_at = refreshed_at
+        if fresh:
+            # Les résultats de l'ancienne version ne seront plus demandés
+            self.results.clear()
+
+    def start_refresher(self, interval):
+        """
+        Démarre (une seule fois) un thread qui rafraîchit les données en arrière-plan.
+
+        Aucune requête d'utilisateur ne paie donc le coût d'un rechargement : les pages
+        lisent toujours la dernière version complète.
+
+        Args:
+            interval (float): Le nombre de secondes entre deux rafraîchissements.
+        """
+        with self._refresh_lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh_forever,
+                args=(interval,),
+                name="dataset-refresher",
+                daemon=True,
+            )
+            self._refresher.start()
+
+    def _refresh_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception:
+                logging.exception(
+                    "Échec du rafraîchissement des données, la version %s est conservée",
+                    self.version,
+                )
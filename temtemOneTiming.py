@@ -0,0 +1,179 @@
+# %%
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+import pandas as pd
+
+# Journal des temps de démarrage : une ligne JSON par exécution, écrite sur la sortie
+# d'erreur même si l'application ne configure pas le module logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.propagate = False
+
+# Nombre maximal d'étapes conservées en mémoire pour le panneau d'administration
+MAX_STAGES = 500
+
+# Étapes mesurées dans ce processus, de la plus ancienne à la plus récente
+_stages = deque(maxlen=MAX_STAGES)
+_stages_lock = threading.Lock()
+_logged_count = 0
+_recorded_count = 0
+
+
+def _rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return value
+
+
+class Stage:
+    """
+    Mesure d'une étape du chargement : durée, lignes en entrée et en sortie, mémoire du résultat.
+
+    Args:
+        name (str): Le nom de l'étape (ex. "parse:orders").
+        rows_in (int | pd.DataFrame, optional): Les lignes en entrée (ou le DataFrame d'entrée).
+    """
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = _rows(rows_in)
+        self.rows_out = None
+        self.memory_mb = None
+        self.seconds = None
+        self.started_at = time.time()
+
+    def output(self, result):
+        """
+        Enregistre le résultat de l'étape (nombre de lignes et mémoire occupée).
+
+        La mémoire est mesurée sans parcourir les valeurs (`deep=False`) : exacte pour
+        les colonnes numériques, catégorielles et string[pyarrow], elle ne compte que
+        les pointeurs des colonnes d'objets Python.
+
+        Args:
+            result (pd.DataFrame | int): Le DataFrame produit, ou un nombre de lignes.
+
+        Returns:
+            Le résultat, inchangé.
+        """
+        self.rows_out = _rows(result)
+        if isinstance(result, pd.DataFrame):
+            self.memory_mb = round(result.memory_usage(deep=False).sum() / 2**20, 2)
+        return result
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "seconds": self.seconds,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "memory_mb": self.memory_mb,
+            "started_at": self.started_at,
+            "thread": threading.current_thread().name,
+        }
+
+
+@contextmanager
+def timed(name, rows_in=None):
+    """
+    Mesure la durée d'une étape et l'ajoute au rapport de démarrage.
+
+    Exemple :
+        with timed("clean:orders", raw) as stage:
+            orders = stage.output(clean_orders(raw))
+
+    Args:
+        name (str): Le nom de l'étape.
+        rows_in (int | pd.DataFrame, optional): Les lignes en entrée (ou le DataFrame d'entrée).
+
+    Yields:
+        Stage: La mesure en cours, pour enregistrer le résultat avec `output`.
+    """
+    global _recorded_count
+    stage = Stage(name, rows_in)
+    start = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        stage.seconds = round(time.perf_counter() - start, 4)
+        with _stages_lock:
+            _stages.append(stage.as_dict())
+            _recorded_count += 1
+
+
+def timed_step(name, func):
+    """
+    Enveloppe une étape de traitement d'un DataFrame (ex. un nettoyage) pour la mesurer à chaque appel.
+
+    Args:
+        name (str): Le nom de l'étape.
+        func (callable): La fonction qui reçoit et renvoie un DataFrame.
+
+    Returns:
+        callable: La fonction mesurée.
+    """
+
+    def step(df):
+        with timed(name, df) as stage:
+            return stage.output(func(df))
+
+    return step
+
+
+def stage_report():
+    """
+    Renvoie les étapes mesurées dans ce processus, pour le panneau d'administration.
+
+    Returns:
+        pd.DataFrame: Une ligne par étape (durée, lignes en entrée et en sortie, mémoire).
+    """
+    with _stages_lock:
+        stages = list(_stages)
+    return pd.DataFrame(
+        stages,
+        columns=[
+            "stage",
+            "seconds",
+            "rows_in",
+            "rows_out",
+            "memory_mb",
+            "started_at",
+            "thread",
+        ],
+    )
+
+
+def log_run(app, run_started):
+    """
+    Écrit une ligne de log structurée (JSON) pour une exécution du script.
+
+    La ligne contient la durée de l'exécution et les étapes terminées depuis la ligne
+    précédente (chargements, nettoyages et hachages faits pendant cette exécution ou
+    en arrière-plan depuis).
+
+    Args:
+        app (str): Le nom de l'application.
+        run_started (float): L'instant de début de l'exécution (time.perf_counter()).
+    """
+    global _logged_count
+    with _stages_lock:
+        new = min(_recorded_count - _logged_count, len(_stages))
+        stages = list(_stages)[len(_stages) - new :] if new else []
+        _logged_count = _recorded_count
+    logger.info(
+        json.dumps(
+            {
+                "event": "startup_timing",
+                "app": app,
+                "run_seconds": round(time.perf_counter() - run_started, 4),
+                "stages": stages,
+            },
+            default=str,
+        )
+    )